@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Decodes and slices each audio file once, then writes any combination of
+# samples (audio_to_samples.py), phrases (audio_to_phrases.py), t-SNE (audio_to_tsne.py) and plots
+# Usage:
+    # python analyze_audio.py -saved 1 -phrases 1 -tsne 1
+    # python analyze_audio.py -in "../audio/downloads/birds/*.mp3" -saved 1 -save 1 -phrases 1 -savep 1 -tsne 1 -plot 1
+
+import argparse
+import csv
+import librosa
+import matplotlib
+# plots are only written to file, so workers don't need a display
+matplotlib.use("Agg")
+import os
+from os.path import join
+import numpy as np
+from pprint import pprint
+import sys
+from utils import getAudioSamples, getEmbedding, getPhrases, normalizeEmbedding, readFiles, runPool, stringifyPhrase, writePhrases
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILES", default="../audio/sample/*.mp3", help="Input file pattern")
+parser.add_argument('-adir', dest="INPUT_AUDIO_DIR", default="../audio/downloads/birds/%s.mp3", help="Input audio directory (if INPUT_FILES is .json file)")
+parser.add_argument('-min', dest="MIN_DUR", default=0.05, type=float, help="Minimum sample duration in seconds")
+parser.add_argument('-max', dest="MAX_DUR", default=1.00, type=float, help="Maximum sample duration in seconds")
+parser.add_argument('-amp', dest="AMP_THESHOLD", default=-1, type=float, help="Amplitude theshold, -1 for default")
+# samples
+parser.add_argument('-samples', dest="SAMPLES", default=8, type=int, help="Max samples to produce per file, -1 for all")
+parser.add_argument('-saved', dest="SAVE_DATA", default=0, type=int, help="Save samples data file?")
+parser.add_argument('-save', dest="SAVE", default=0, type=int, help="Save sample audio files?")
+parser.add_argument('-dir', dest="SAMPLE_DIR", default="../audio/output/birds", help="Output dir for sample audio")
+parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_samples.csv", help="Samples CSV output file")
+# phrases
+parser.add_argument('-phrases', dest="PHRASES", default=0, type=int, help="Save phrases data file?")
+parser.add_argument('-savep', dest="SAVE_PHRASES", default=0, type=int, help="Save phrase audio files?")
+parser.add_argument('-minp', dest="MIN_PHRASE_DUR", default=0.5, type=float, help="Minimum phrase duration in seconds")
+parser.add_argument('-maxp', dest="MAX_PHRASE_DUR", default=5.00, type=float, help="Maximum phrase duration in seconds")
+parser.add_argument('-maxs', dest="MAX_SILENCE", default=0.25, type=float, help="Maximum silence between samples in phrase in seconds")
+parser.add_argument('-pdir', dest="PHRASE_DIR", default="../audio/output/birds_phrases", help="Output dir for phrase audio")
+parser.add_argument('-pout', dest="PHRASE_FILE", default="../data/output/birds_audio_phrases.csv", help="Phrases CSV output file")
+parser.add_argument('-pcols', dest="SAVE_PHRASE_COLUMNS", default=1, type=int, help="Also save phrases as a column store next to the phrases CSV file?")
+# t-SNE
+parser.add_argument('-tsne', dest="TSNE", default=0, type=int, help="Save t-SNE data file?")
+parser.add_argument('-tsamples', dest="TSNE_SAMPLES", default=1, type=int, help="Max samples per file to use for t-SNE, -1 for all")
+parser.add_argument('-tembed', dest="EMBED_METHOD", default="tsne", help="Embedding: auto, tsne, opentsne, multicore, umap, pca")
+parser.add_argument('-tpca', dest="PCA_COMPONENTS", default=-1, type=int, help="Reduce features to this many components before embedding, -1 to keep all")
+parser.add_argument('-tlr', dest="LEARNING_RATE", default=150.0, type=float, help="t-SNE learning rate, -1 to scale with sample count")
+parser.add_argument('-tangle', dest="ANGLE", default=0.1, type=float, help="Barnes-Hut angle (tsne, multicore); increase to make faster, decrease to make more accurate")
+parser.add_argument('-tperplexity', dest="PERPLEXITY", default=30.0, type=float, help="t-SNE perplexity")
+parser.add_argument('-tseed', dest="SEED", default=1, type=int, help="Random seed")
+parser.add_argument('-tthreads', dest="THREADS", default=-1, type=int, help="Embedding threads, -1 for all cores")
+parser.add_argument('-tout', dest="TSNE_FILE", default="../data/output/birds_audio_tsne.csv", help="t-SNE CSV output file")
+# plots
+parser.add_argument('-plot', dest="PLOT", default=0, type=int, help="Save plots?")
+parser.add_argument('-plotdir', dest="PLOT_DIR", default="../data/output/plot/%s.png", help="Output dir for plot images")
+parser.add_argument('-overwrite', dest="OVERWRITE", default=0, type=int, help="Overwrite existing audio/plots?")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of worker processes, -1 for all cores")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=1, type=int, help="Number of files sent to a worker at a time")
+parser.add_argument('-timeout', dest="TIMEOUT", default=-1, type=float, help="Seconds before giving up on a file, -1 for no limit")
+args = parser.parse_args()
+
+# Parse arguments
+INPUT_FILES = args.INPUT_FILES
+INPUT_AUDIO_DIR = args.INPUT_AUDIO_DIR
+MIN_DUR = args.MIN_DUR
+MAX_DUR = args.MAX_DUR
+AMP_THESHOLD = args.AMP_THESHOLD
+SAMPLES = args.SAMPLES
+SAVE_DATA = args.SAVE_DATA > 0
+SAVE = args.SAVE > 0
+SAMPLE_DIR = args.SAMPLE_DIR
+OUTPUT_FILE = args.OUTPUT_FILE
+PHRASES = args.PHRASES > 0
+SAVE_PHRASES = args.SAVE_PHRASES > 0
+MIN_PHRASE_DUR = args.MIN_PHRASE_DUR
+MAX_PHRASE_DUR = args.MAX_PHRASE_DUR
+MAX_SILENCE = args.MAX_SILENCE
+PHRASE_DIR = args.PHRASE_DIR
+PHRASE_FILE = args.PHRASE_FILE
+SAVE_PHRASE_COLUMNS = args.SAVE_PHRASE_COLUMNS > 0
+TSNE = args.TSNE > 0
+TSNE_SAMPLES = args.TSNE_SAMPLES
+TSNE_FILE = args.TSNE_FILE
+EMBED_METHOD = args.EMBED_METHOD
+PCA_COMPONENTS = args.PCA_COMPONENTS
+LEARNING_RATE = args.LEARNING_RATE
+ANGLE = args.ANGLE
+PERPLEXITY = args.PERPLEXITY
+SEED = args.SEED
+THREADS = args.THREADS
+PLOT = args.PLOT > 0
+PLOT_DIR = args.PLOT_DIR
+OVERWRITE = args.OVERWRITE > 0
+CACHE_DIR = args.CACHE_DIR
+WORKERS = args.WORKERS
+CHUNK_SIZE = args.CHUNK_SIZE
+TIMEOUT = args.TIMEOUT
+
+if SAMPLES <= 0:
+    SAMPLES = None
+if TSNE_SAMPLES <= 0:
+    TSNE_SAMPLES = None
+
+if not (SAVE_DATA or SAVE or PHRASES or SAVE_PHRASES or TSNE or PLOT):
+    print("Nothing to do: set at least one of -saved, -save, -phrases, -savep, -tsne, -plot")
+    sys.exit(1)
+
+# Audio config
+FFT = 2048
+HOP_LEN = FFT/4
+
+# Read files
+fileGroups, files = readFiles(INPUT_FILES, INPUT_AUDIO_DIR)
+fileCount = len(files)
+hasGroups = len(fileGroups) > 1
+print("Found %s files" % fileCount)
+
+# Make sure output dirs exist
+outDirs = []
+if SAVE_DATA:
+    outDirs.append(os.path.dirname(OUTPUT_FILE))
+if SAVE:
+    outDirs.append(SAMPLE_DIR)
+if PHRASES:
+    outDirs.append(os.path.dirname(PHRASE_FILE))
+if SAVE_PHRASES:
+    outDirs.append(PHRASE_DIR)
+if TSNE:
+    outDirs.append(os.path.dirname(TSNE_FILE))
+if PLOT:
+    outDirs.append(os.path.dirname(PLOT_DIR))
+for outDir in outDirs:
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+
+def writeSample(outFn, ysample, sr):
+    if OVERWRITE or not os.path.isfile(outFn):
+        sample = np.copy(ysample)
+        sample /= np.abs(sample).max()
+        librosa.output.write_wav(outFn, sample, sr)
+
+def analyzeFile(fn):
+    result = {"samples": [], "phrases": [], "features": []}
+    basename = os.path.splitext(os.path.basename(fn))[0]
+    path, groupName = os.path.split(os.path.dirname(fn))
+    groupName = "" if not hasGroups else groupName
+    plotfilename = PLOT_DIR % basename
+    plot = PLOT and (OVERWRITE or not os.path.isfile(plotfilename))
+
+    # decode and slice once
+    sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=plot, plotfilename=plotfilename, groupName=groupName, cacheDir=CACHE_DIR, features=TSNE)
+    if len(sampleData) <= 0:
+        return result
+
+    # samples: if too many, take the ones with the most power, then sort chronologically
+    if SAVE_DATA or SAVE:
+        samples = sampleData[:]
+        if SAMPLES is not None and len(samples) > SAMPLES:
+            samples = sorted(samples, key=lambda k: k['power'], reverse=True)
+            samples = samples[:SAMPLES]
+        if SAVE:
+            for d in samples:
+                writeSample(join(SAMPLE_DIR, d["filename"]), ysamples[d["index"]], sr)
+        result["samples"] = sorted(samples, key=lambda k: k['start'])
+
+    # phrases: group all samples in this file
+    if PHRASES or SAVE_PHRASES:
+        phrases = getPhrases(sampleData, minLen=MIN_PHRASE_DUR, maxLen=MAX_PHRASE_DUR, maxSilence=MAX_SILENCE)
+        for i, phrase in enumerate(phrases):
+            phrases[i]["parent"] = basename
+            phrases[i]["filename"] = "%s %s.wav" % (basename, phrase["start"])
+            if SAVE_PHRASES:
+                writeSample(join(PHRASE_DIR, phrase["filename"]), y[phrase["left"]*HOP_LEN:phrase["right"]*HOP_LEN], sr)
+        result["phrases"] = phrases
+
+    # t-SNE features of the samples with the most power
+    if TSNE:
+        samples = sampleData[:]
+        if TSNE_SAMPLES is not None and len(samples) > TSNE_SAMPLES:
+            samples = sorted(samples, key=lambda k: k['power'], reverse=True)
+            samples = samples[:TSNE_SAMPLES]
+        for d in samples:
+            result["features"].append({
+                "parent": basename,
+                "group": groupName,
+                "note": d["note"],
+                "start": d["start"],
+                "dur": d["dur"],
+                "featureVector": d["featureVector"]
+            })
+
+    return result
+
+# plots are written to file in the workers
+data, errors = runPool(analyzeFile, files, workers=WORKERS, chunksize=CHUNK_SIZE, timeout=TIMEOUT, default={"samples": [], "phrases": [], "features": []}, returnErrors=True)
+print("")
+
+if SAVE_DATA:
+    print("Writing samples to file...")
+    headings = ["parent", "group", "start", "dur", "power", "hz", "note", "octave"]
+    rowCount = 0
+    with open(OUTPUT_FILE, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(headings)
+        for d in data:
+            for entry in d["samples"]:
+                writer.writerow([entry[key] for key in headings])
+                rowCount += 1
+    print("Wrote %s rows to %s" % (rowCount, OUTPUT_FILE))
+
+if PHRASES:
+    print("Writing phrases to file...")
+    headings = ["parent", "start", "dur", "phrase"]
+    rowCount = 0
+    with open(PHRASE_FILE, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(headings)
+        for d in data:
+            for entry in d["phrases"]:
+                writer.writerow([entry["parent"], entry["start"], entry["dur"], stringifyPhrase(entry["phrase"])])
+                rowCount += 1
+    print("Wrote %s rows to %s" % (rowCount, PHRASE_FILE))
+    # notes as one flat table plus phrase offsets
+    if SAVE_PHRASE_COLUMNS:
+        writePhrases(os.path.splitext(PHRASE_FILE)[0] + ".cols", [entry for d in data for entry in d["phrases"]])
+
+if TSNE:
+    features = [item for d in data for item in d["features"]]
+    print("%s samples found for t-SNE." % len(features))
+    if len(features) > 1:
+        model = getEmbedding([d["featureVector"] for d in features], method=EMBED_METHOD, pca=PCA_COMPONENTS, learningRate=LEARNING_RATE, angle=ANGLE, perplexity=PERPLEXITY, seed=SEED, threads=THREADS)
+        modelNorm = normalizeEmbedding(model)
+        precision = 5
+        headings = ["parent", "group", "start", "dur", "x", "y"]
+        with open(TSNE_FILE, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(headings)
+            for i, d in enumerate(features):
+                writer.writerow([d["parent"], d["group"], d["start"], d["dur"], round(modelNorm[i,0], precision), round(modelNorm[i,1], precision)])
+        print("Wrote %s rows to %s" % (len(features), TSNE_FILE))
+
+# failed files are listed above; they are missing from the output
+if len(errors) > 0:
+    print("%s of %s files failed" % (len(errors), len(files)))
+    sys.exit(1)
@@ -22,6 +22,7 @@ from os.path import join
 import numpy as np
 from pprint import pprint
 import sys
+from utils import loadAudio
 
 # input
 parser = argparse.ArgumentParser()
@@ -33,6 +34,7 @@ parser.add_argument('-width', dest="WIDTH", default=3600, type=int, help="Target
 parser.add_argument('-height', dest="HEIGHT", default=600, type=int, help="Target height")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/images/%s.png", help="Output file pattern")
 parser.add_argument('-overwrite', dest="OVERWRITE", default=0, type=int, help="Overwrite existing images?")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
 args = parser.parse_args()
 
 # Parse arguments
@@ -42,6 +44,7 @@ SAVE = args.SAVE > 0
 PLOT = args.PLOT > 0
 OUTPUT_FILE = args.OUTPUT_FILE
 OVERWRITE = args.OVERWRITE > 0
+CACHE_DIR = args.CACHE_DIR
 
 # Audio config
 FFT = 2048
@@ -74,7 +77,7 @@ def makeImage(fn):
     w = 24
     h = 8
 
-    y, sr = librosa.load(fn)
+    y, sr = loadAudio(fn, cacheDir=CACHE_DIR)
     D = librosa.amplitude_to_db(np.abs(librosa.stft(y)), ref=np.max)
 
     figure = plt.figure(figsize=(3600, 600), dpi=1)
@@ -7,28 +7,31 @@ import csv
 import glob
 import math
 from mutagen.mp3 import MP3
-from multiprocessing import Pool
-from multiprocessing.dummy import Pool as ThreadPool
-import librosa
 import os
 from pprint import pprint
 import re
 import sys
+from utils import runPool
 
 # input
 parser = argparse.ArgumentParser()
 parser.add_argument('-in', dest="INPUT_FILES", default="../audio/sample/*.mp3", help="Input file pattern")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_metadata.csv", help="CSV output file")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of worker processes, -1 for all cores")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=1, type=int, help="Number of files sent to a worker at a time")
+parser.add_argument('-timeout', dest="TIMEOUT", default=-1, type=float, help="Seconds before giving up on a file, -1 for no limit")
 
 args = parser.parse_args()
 
 INPUT_FILES = args.INPUT_FILES
 OUTPUT_FILE = args.OUTPUT_FILE
+WORKERS = args.WORKERS
+CHUNK_SIZE = args.CHUNK_SIZE
+TIMEOUT = args.TIMEOUT
 
 files = glob.glob(INPUT_FILES)
 fileCount = len(files)
 print("Found %s files" % fileCount)
-progress = 0
 
 # Make sure output dirs exist
 outDir = os.path.dirname(OUTPUT_FILE)
@@ -45,14 +48,13 @@ def isAuthor(str):
     return ("." in str or "Sharon" in str or "Richard" in str)
 
 def readFile(f):
-    global progress
     basename = os.path.splitext(os.path.basename(f))[0]
 
-    # use librosa to get duration
-    duration = round(librosa.get_duration(filename=f), 3)
-
     audio = MP3(f)
 
+    # duration from the mp3 header, without decoding the audio
+    duration = round(audio.info.length, 3)
+
     # parse filename for metadata
     name = ""
     sampleNumber = 0
@@ -146,18 +148,13 @@ def readFile(f):
     }
     # print(entry)
     # print("---")
-    progress += 1
-    sys.stdout.write('\r')
-    sys.stdout.write("%s%%" % round(1.0*progress/fileCount*100,1))
-    sys.stdout.flush()
     return entry
 
 # files = files[:100]
 
-pool = ThreadPool()
-metadata = pool.map(readFile, files)
-pool.close()
-pool.join()
+metadata = runPool(readFile, files, workers=WORKERS, chunksize=CHUNK_SIZE, timeout=TIMEOUT)
+# skip files that failed or timed out
+metadata = [entry for entry in metadata if entry is not None]
 
 print("Writing data to file...")
 headings = ["filename", "uid", "name", "species", "description", "groups", "sample", "duration", "state", "country", "placecode", "date", "authors"]
@@ -167,4 +164,4 @@ with open(OUTPUT_FILE, 'wb') as f:
     for entry in metadata:
         writer.writerow([entry[key] for key in headings])
 
-print("Wrote %s rows to %s" % (fileCount, OUTPUT_FILE))
+print("Wrote %s rows to %s" % (len(metadata), OUTPUT_FILE))
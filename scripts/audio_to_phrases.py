@@ -11,14 +11,12 @@ import argparse
 import csv
 import glob
 import librosa
-from multiprocessing import Pool
-from multiprocessing.dummy import Pool as ThreadPool
 import os
 from os.path import join
 import numpy as np
 from pprint import pprint
 import sys
-from utils import getAudioSamples, getPhrases
+from utils import getAudioSamples, getPhrases, runPool, stringifyPhrase, writePhrases
 
 # input
 parser = argparse.ArgumentParser()
@@ -34,7 +32,12 @@ parser.add_argument('-saved', dest="SAVE_DATA", default=0, type=int, help="Save
 parser.add_argument('-plot', dest="PLOT", default=0, type=int, help="Show plot?")
 parser.add_argument('-dir', dest="SAMPLE_DIR", default="../audio/output/birds_phrases", help="Output dir")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_phrases.csv", help="CSV output file")
+parser.add_argument('-cols', dest="SAVE_COLUMNS", default=1, type=int, help="Also save phrases as a column store next to the CSV output file?")
 parser.add_argument('-overwrite', dest="OVERWRITE", default=0, type=int, help="Overwrite existing audio/data?")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of worker processes, -1 for all cores")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=1, type=int, help="Number of files sent to a worker at a time")
+parser.add_argument('-timeout', dest="TIMEOUT", default=-1, type=float, help="Seconds before giving up on a file, -1 for no limit")
 args = parser.parse_args()
 
 # Parse arguments
@@ -50,7 +53,12 @@ SAVE_DATA = args.SAVE_DATA > 0
 PLOT = args.PLOT > 0
 SAMPLE_DIR = args.SAMPLE_DIR
 OUTPUT_FILE = args.OUTPUT_FILE
+SAVE_COLUMNS = args.SAVE_COLUMNS > 0
 OVERWRITE = args.OVERWRITE > 0
+CACHE_DIR = args.CACHE_DIR
+WORKERS = args.WORKERS
+CHUNK_SIZE = args.CHUNK_SIZE
+TIMEOUT = args.TIMEOUT
 
 # Audio config
 FFT = 2048
@@ -68,12 +76,10 @@ for outDir in outDirs:
         os.makedirs(outDir)
 
 # files = [files[2]]
-progress = 0
 def makePhrases(fn):
-    global progress
     # get sample data
     basename = os.path.splitext(os.path.basename(fn))[0]
-    sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=PLOT)
+    sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=PLOT, cacheDir=CACHE_DIR)
 
     # get phrases from sample data
     phrases = getPhrases(sampleData, minLen=MIN_PHRASE_DUR, maxLen=MAX_PHRASE_DUR, maxSilence=MAX_SILENCE)
@@ -83,9 +89,6 @@ def makePhrases(fn):
     for i, phrase in enumerate(phrases):
         phrases[i]["parent"] = basename
         phrases[i]["filename"] = "%s %s.wav" % (basename, phrase["start"])
-        # stringify phrase
-        rows = [[n["start"], n["dur"], n["power"], n["hz"], n["note"], n["octave"]] for n in phrase["phrase"]]
-        phrases[i]["phrase"] = ",".join([":".join([str(col) for col in row]) for row in rows])
 
     if SAVE:
         for phrase in phrases:
@@ -96,19 +99,14 @@ def makePhrases(fn):
                 sample /= np.abs(sample).max()
                 librosa.output.write_wav(outFn, sample, sr)
 
-    progress += 1
-    sys.stdout.write('\r')
-    sys.stdout.write("%s%%" % round(1.0*progress/fileCount*100,1))
-    sys.stdout.flush()
-
     return phrases
 
 # files = [files[1]]
 
-pool = ThreadPool()
-data = pool.map(makePhrases, files)
-pool.close()
-pool.join()
+# plot in this process
+workers = 1 if PLOT else WORKERS
+data, errors = runPool(makePhrases, files, workers=workers, chunksize=CHUNK_SIZE, timeout=TIMEOUT, default=[], returnErrors=True)
+print("")
 
 if SAVE_DATA:
     print("Writing data to file...")
@@ -119,6 +117,14 @@ if SAVE_DATA:
         writer.writerow(headings)
         for pdata in data:
             for entry in pdata:
-                writer.writerow([entry[key] for key in headings])
+                writer.writerow([entry["parent"], entry["start"], entry["dur"], stringifyPhrase(entry["phrase"])])
                 rowCount += 1
     print("Wrote %s rows to %s" % (rowCount, OUTPUT_FILE))
+    # notes as one flat table plus phrase offsets
+    if SAVE_COLUMNS:
+        writePhrases(os.path.splitext(OUTPUT_FILE)[0] + ".cols", [entry for pdata in data for entry in pdata])
+
+# failed files are listed above; they are missing from the output
+if len(errors) > 0:
+    print("%s of %s files failed" % (len(errors), len(files)))
+    sys.exit(1)
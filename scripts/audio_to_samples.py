@@ -6,21 +6,21 @@
     # python audio_to_samples.py -plot 1
     # python audio_to_samples.py -save 1
     # python audio_to_samples.py -in "../audio/downloads/birds/*.mp3" -saved 1
+    # python audio_to_samples.py -in "../audio/downloads/birds/*.mp3" -saved 1 -incremental 0
     # python audio_to_samples.py -in "../data/usergen/saved_birds.json" -plot 1
+    # python audio_to_samples.py -in "../audio/downloads/long/*.mp3" -saved 1 -save 1 -stream 1
 
 import argparse
 import csv
 import glob
 import json
 import librosa
-from multiprocessing import Pool
-from multiprocessing.dummy import Pool as ThreadPool
 import os
 from os.path import join
 import numpy as np
 from pprint import pprint
 import sys
-from utils import getAudioSamples, readFiles
+from utils import getAudioSamples, getManifestChanges, getManifestKey, readCsv, readFiles, readManifest, runPool, streamAudioSamples, writeManifest
 
 # input
 parser = argparse.ArgumentParser()
@@ -37,6 +37,14 @@ parser.add_argument('-plotdir', dest="PLOT_DIR", default="../data/output/plot/%s
 parser.add_argument('-dir', dest="SAMPLE_DIR", default="../audio/output/birds", help="Output dir")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_samples.csv", help="CSV output file")
 parser.add_argument('-overwrite', dest="OVERWRITE", default=0, type=int, help="Overwrite existing audio/data?")
+parser.add_argument('-incremental', dest="INCREMENTAL", default=1, type=int, help="Only process new or changed files and merge into the existing data file?")
+parser.add_argument('-manifest', dest="MANIFEST_FILE", default="", help="Manifest of processed files, defaults to the CSV output file with _manifest.json")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
+parser.add_argument('-stream', dest="STREAM", default=0, type=int, help="Read audio in blocks to bound memory for long recordings?")
+parser.add_argument('-block', dest="BLOCK_SIZE", default=1048576, type=int, help="Block size in audio samples when streaming")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of worker processes, -1 for all cores")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=1, type=int, help="Number of files sent to a worker at a time")
+parser.add_argument('-timeout', dest="TIMEOUT", default=-1, type=float, help="Seconds before giving up on a file, -1 for no limit")
 args = parser.parse_args()
 
 # Parse arguments
@@ -53,11 +61,20 @@ PLOT_DIR = args.PLOT_DIR
 SAMPLE_DIR = args.SAMPLE_DIR
 OUTPUT_FILE = args.OUTPUT_FILE
 OVERWRITE = args.OVERWRITE > 0
+INCREMENTAL = args.INCREMENTAL > 0
+MANIFEST_FILE = args.MANIFEST_FILE if len(args.MANIFEST_FILE) > 0 else os.path.splitext(args.OUTPUT_FILE)[0] + "_manifest.json"
+CACHE_DIR = args.CACHE_DIR
+STREAM = args.STREAM > 0
+BLOCK_SIZE = args.BLOCK_SIZE
+WORKERS = args.WORKERS
+CHUNK_SIZE = args.CHUNK_SIZE
+TIMEOUT = args.TIMEOUT
 
 if SAMPLES <= 0:
     SAMPLES = None
 
 # Audio config
+SAMPLE_RATE = 22050
 FFT = 2048
 HOP_LEN = FFT/4
 
@@ -67,6 +84,27 @@ fileCount = len(files)
 hasGroups = len(fileGroups) > 1
 print("Found %s files" % fileCount)
 
+# Only process files that are new, changed, or were analyzed with other parameters
+manifest = {}
+manifestEntries = {}
+existingRows = []
+inputFiles = files
+if SAVE_DATA and INCREMENTAL:
+    params = {
+        "min": MIN_DUR,
+        "max": MAX_DUR,
+        "amp": AMP_THESHOLD,
+        "fft": FFT,
+        "hop": HOP_LEN,
+        "samples": SAMPLES if SAMPLES is not None else -1,
+        "groups": hasGroups
+    }
+    if os.path.isfile(OUTPUT_FILE):
+        manifest = readManifest(MANIFEST_FILE)
+        existingRows = readCsv(OUTPUT_FILE, doParseNumbers=False)
+    files, manifestEntries = getManifestChanges(files, manifest, params, workers=WORKERS)
+    print("%s new or changed files to process" % len(files))
+
 # Make sure output dirs exist
 outDirs = [SAMPLE_DIR, os.path.dirname(OUTPUT_FILE)]
 if PLOT:
@@ -75,67 +113,95 @@ for outDir in outDirs:
     if not os.path.exists(outDir):
         os.makedirs(outDir)
 
-progress = 0
 # files = files[:1]
 
-def makeSamples(fn):
-    global progress
-    global hasGroups
+def selectSamples(sampleData):
+    # if too many samples, take the ones with the most power
+    if SAMPLES is not None and len(sampleData) > SAMPLES and (SAVE or SAVE_DATA):
+        sampleData = sorted(sampleData, key=lambda k: k['power'], reverse=True)
+        sampleData = sampleData[:SAMPLES]
+    return sampleData
 
-    sampleData = []
+def writeSample(d, ysample, sr):
+    outFn = join(SAMPLE_DIR, d["filename"])
+    if OVERWRITE or not os.path.isfile(outFn):
+        sample = np.copy(ysample)
+        sample /= np.abs(sample).max()
+        librosa.output.write_wav(outFn, sample, sr)
+
+def getParentKey(fn):
     basename = os.path.splitext(os.path.basename(fn))[0]
     path, groupName = os.path.split(os.path.dirname(fn))
     groupName = "" if not hasGroups else groupName
+    return (basename, groupName)
+
+def makeSamples(fn):
+    sampleData = []
+    basename, groupName = getParentKey(fn)
     plotfilename = PLOT_DIR % basename
 
     if SAVE_DATA or SAVE or PLOT and (OVERWRITE or not os.path.isfile(plotfilename)):
 
-        sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=PLOT, plotfilename=plotfilename, groupName=groupName)
-
-        # if too many samples, take the ones with the most power
-        if SAMPLES is not None and len(sampleData) > SAMPLES and (SAVE or SAVE_DATA):
-            sampleData = sorted(sampleData, key=lambda k: k['power'], reverse=True)
-            sampleData = sampleData[:SAMPLES]
-
-        if SAVE:
-            for d in sampleData:
-                ysample = ysamples[d["index"]]
-                outFn = join(SAMPLE_DIR, d["filename"])
-                if OVERWRITE or not os.path.isfile(outFn):
-                    sample = np.copy(ysample)
-                    sample /= np.abs(sample).max()
-                    librosa.output.write_wav(outFn, sample, sr)
+        # samples are cut out block by block, so the whole recording is never in memory
+        if STREAM:
+            sampleData = []
+            for d, ysample in streamAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=PLOT, plotfilename=plotfilename, groupName=groupName, cacheDir=CACHE_DIR, sr=SAMPLE_RATE, blockSize=BLOCK_SIZE, select=selectSamples, withAudio=SAVE):
+                if SAVE:
+                    writeSample(d, ysample, SAMPLE_RATE)
+                sampleData.append(d)
+
+        else:
+            sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, plot=PLOT, plotfilename=plotfilename, groupName=groupName, cacheDir=CACHE_DIR)
+            sampleData = selectSamples(sampleData)
+            if SAVE:
+                for d in sampleData:
+                    writeSample(d, ysamples[d["index"]], sr)
 
         # sort chronologically
         if SAVE or SAVE_DATA:
             sampleData = sorted(sampleData, key=lambda k: k['start'])
 
-    progress += 1
-    sys.stdout.write('\r')
-    sys.stdout.write("%s%%" % round(1.0*progress/fileCount*100,1))
-    sys.stdout.flush()
-
     return sampleData
 
-if PLOT:
-    for fn in files:
-        makeSamples(fn)
-
-else:
-    pool = ThreadPool()
-    data = pool.map(makeSamples, files)
-    pool.close()
-    pool.join()
+# plot in this process
+workers = 1 if PLOT else WORKERS
+data = runPool(makeSamples, files, workers=workers, chunksize=CHUNK_SIZE, timeout=TIMEOUT)
+print("")
 
 if SAVE_DATA:
     print("Writing data to file...")
     headings = ["parent", "group", "start", "dur", "power", "hz", "note", "octave"]
+    # keep existing rows of input files that weren't processed again; a file that fails on a re-run keeps its old rows
+    inputKeys = set([getParentKey(fn) for fn in inputFiles])
+    processed = set([getParentKey(fn) for fn, sdata in zip(files, data) if sdata is not None])
+    existingRows = [row for row in existingRows if (row["parent"], row["group"]) in inputKeys and (row["parent"], row["group"]) not in processed]
     rowCount = 0
     with open(OUTPUT_FILE, 'wb') as f:
         writer = csv.writer(f)
         writer.writerow(headings)
+        for row in existingRows:
+            writer.writerow([row[key] for key in headings])
         for sdata in data:
+            if sdata is None:
+                continue
             for entry in sdata:
                 writer.writerow([entry[key] for key in headings])
                 rowCount += 1
-    print("Wrote %s rows to %s" % (rowCount, OUTPUT_FILE))
+    print("Wrote %s rows to %s (%s kept, %s new)" % (len(existingRows)+rowCount, OUTPUT_FILE, len(existingRows), rowCount))
+
+    if INCREMENTAL:
+        # forget files that are no longer in the input, their rows were dropped above
+        inputManifestKeys = set([getManifestKey(fn) for fn in inputFiles])
+        manifest = dict([(key, entry) for key, entry in manifest.items() if key in inputManifestKeys])
+        for fn, sdata in zip(files, data):
+            key = getManifestKey(fn)
+            # files that failed are processed again next time
+            if sdata is None:
+                manifest.pop(key, None)
+            else:
+                manifest[key] = manifestEntries[key]
+        writeManifest(MANIFEST_FILE, manifest)
+
+    # a full run replaces all rows, so an old manifest no longer describes the data file
+    elif os.path.isfile(MANIFEST_FILE):
+        os.remove(MANIFEST_FILE)
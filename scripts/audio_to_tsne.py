@@ -1,21 +1,23 @@
 # -*- coding: utf-8 -*-
 
 # python audio_to_tsne.py -W ignore -in "../audio/downloads/birds/*.mp3,../audio/downloads/ph_string/*.mp3,../audio/downloads/ph_wind/*.mp3,../audio/downloads/ph_percussion/*.mp3" -saved 1
+# python audio_to_tsne.py -W ignore -in "../audio/downloads/birds/*.mp3" -samples -1 -saved 1 -embed auto -pca 20 -lr -1
+# add new recordings to an existing map without re-running t-SNE (appends to the CSV output file):
+# python audio_to_tsne.py -W ignore -in "../audio/downloads/birds/*.mp3" -saved 1 -place 1
+# feature vectors are kept in a store next to the output file, so later runs only process new or changed audio:
+# python audio_to_tsne.py -W ignore -in "../audio/downloads/birds/*.mp3" -saved 1 -plot 1 -highlight note
 
 import argparse
 import csv
 import json
 import librosa
 from matplotlib import pyplot as plt
-from multiprocessing import Pool
-from multiprocessing.dummy import Pool as ThreadPool
 import os
 from os.path import join
 import numpy as np
 from pprint import pprint
-from sklearn.manifold import TSNE
 import sys
-from utils import getAudioSamples, readFiles
+from utils import FEATURE_COLUMNS, getAudioSamples, getEmbedding, getEmbeddingBounds, getFeatureKeys, getManifestChanges, getManifestKey, normalizeEmbedding, placeEmbedding, readEmbedding, readFeatures, readFiles, runPool, selectFeatures, writeEmbedding, writeFeatures
 
 # input
 parser = argparse.ArgumentParser()
@@ -29,6 +31,22 @@ parser.add_argument('-plot', dest="PLOT", default=0, type=int, help="Show plot?"
 parser.add_argument('-highlight', dest="HIGHLIGHT", default="group", help="What to highlight: group, note, parent")
 parser.add_argument('-saved', dest="SAVE_DATA", default=0, type=int, help="Save data files?")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_tsne.csv", help="CSV output file")
+parser.add_argument('-embed', dest="EMBED_METHOD", default="tsne", help="Embedding: auto, tsne, opentsne, multicore, umap, pca")
+parser.add_argument('-pca', dest="PCA_COMPONENTS", default=-1, type=int, help="Reduce features to this many components before embedding, -1 to keep all")
+parser.add_argument('-lr', dest="LEARNING_RATE", default=150.0, type=float, help="t-SNE learning rate, -1 to scale with sample count")
+parser.add_argument('-angle', dest="ANGLE", default=0.1, type=float, help="Barnes-Hut angle (tsne, multicore); increase to make faster, decrease to make more accurate")
+parser.add_argument('-perplexity', dest="PERPLEXITY", default=30.0, type=float, help="t-SNE perplexity")
+parser.add_argument('-seed', dest="SEED", default=1, type=int, help="Random seed")
+parser.add_argument('-threads', dest="THREADS", default=-1, type=int, help="Embedding threads, -1 for all cores")
+parser.add_argument('-place', dest="PLACE", default=0, type=int, help="Place samples that aren't in the saved embedding into it, instead of embedding everything again?")
+parser.add_argument('-embedding', dest="EMBEDDING_FILE", default="", help="Saved raw embedding, defaults to the CSV output file with _embedding.npz")
+parser.add_argument('-features', dest="FEATURE_DIR", default="", help="Feature vector store, defaults to the CSV output file with _features")
+parser.add_argument('-store', dest="STORE", default=1, type=int, help="Reuse and save feature vectors in the store?")
+parser.add_argument('-dtype', dest="DTYPE", default="float32", help="Stored feature vector type: float32 or float16")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of worker processes, -1 for all cores")
+parser.add_argument('-chunk', dest="CHUNK_SIZE", default=1, type=int, help="Number of files sent to a worker at a time")
+parser.add_argument('-timeout', dest="TIMEOUT", default=-1, type=float, help="Seconds before giving up on a file, -1 for no limit")
 args = parser.parse_args()
 
 # Parse arguments
@@ -42,6 +60,22 @@ PLOT = args.PLOT > 0
 HIGHLIGHT = args.HIGHLIGHT
 SAVE_DATA = args.SAVE_DATA > 0
 OUTPUT_FILE = args.OUTPUT_FILE
+EMBED_METHOD = args.EMBED_METHOD
+PCA_COMPONENTS = args.PCA_COMPONENTS
+LEARNING_RATE = args.LEARNING_RATE
+ANGLE = args.ANGLE
+PERPLEXITY = args.PERPLEXITY
+SEED = args.SEED
+THREADS = args.THREADS
+PLACE = args.PLACE > 0
+EMBEDDING_FILE = args.EMBEDDING_FILE if len(args.EMBEDDING_FILE) > 0 else os.path.splitext(args.OUTPUT_FILE)[0] + "_embedding.npz"
+FEATURE_DIR = args.FEATURE_DIR if len(args.FEATURE_DIR) > 0 else os.path.splitext(args.OUTPUT_FILE)[0] + "_features"
+STORE = args.STORE > 0
+DTYPE = args.DTYPE
+CACHE_DIR = args.CACHE_DIR
+WORKERS = args.WORKERS
+CHUNK_SIZE = args.CHUNK_SIZE
+TIMEOUT = args.TIMEOUT
 
 # Audio config
 FFT = 2048
@@ -53,36 +87,44 @@ fileCount = len(files)
 hasGroups = len(fileGroups) > 1
 print("Found %s files" % fileCount)
 
+# Only compute features for files that are new, changed, or were analyzed with other parameters
+params = {
+    "min": MIN_DUR,
+    "max": MAX_DUR,
+    "amp": AMP_THESHOLD,
+    "fft": FFT,
+    "hop": HOP_LEN,
+    "samples": SAMPLES if SAMPLES is not None else -1,
+    "groups": hasGroups
+}
+manifest = {}
+manifestEntries = {}
+storedData, storedVectors = (None, None)
+inputFiles = files
+if STORE:
+    storedData, storedVectors, storedParams, manifest = readFeatures(FEATURE_DIR)
+    if storedParams is not None and storedParams != params:
+        print("Feature parameters changed since the store was written")
+    files, manifestEntries = getManifestChanges(files, manifest, params, workers=WORKERS)
+    print("%s new or changed files to process" % len(files))
+
 # Make sure output dirs exist
 outDirs = [os.path.dirname(OUTPUT_FILE)]
 for outDir in outDirs:
     if not os.path.exists(outDir):
         os.makedirs(outDir)
 
-# snatched from: https://github.com/ml4a/ml4a-guides/blob/master/notebooks/audio-tsne.ipynb
-def getFeatures(y, sr):
-    # y = y[0:sr]  # analyze just first second
-    S = librosa.feature.melspectrogram(y, sr=sr, n_mels=128)
-    log_S = librosa.amplitude_to_db(S, ref=np.max)
-    mfcc = librosa.feature.mfcc(S=log_S, n_mfcc=13)
-    delta_mfcc = librosa.feature.delta(mfcc, mode='nearest')
-    delta2_mfcc = librosa.feature.delta(mfcc, order=2, mode='nearest')
-    feature_vector = np.concatenate((np.mean(mfcc,1), np.mean(delta_mfcc,1), np.mean(delta2_mfcc,1)))
-    feature_vector = (feature_vector-np.mean(feature_vector))/np.std(feature_vector)
-    return feature_vector
-
-progress = 0
-def doTSNE(fn):
-    global progress
-    global fileCount
-    global hasGroups
-
-    sampleData = []
+def getParentKey(fn):
     basename = os.path.splitext(os.path.basename(fn))[0]
     path, groupName = os.path.split(os.path.dirname(fn))
     groupName = "" if not hasGroups else groupName
+    return (basename, groupName)
+
+def doTSNE(fn):
+    sampleData = []
+    basename, groupName = getParentKey(fn)
 
-    sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, groupName=groupName)
+    sampleData, ysamples, y, sr = getAudioSamples(fn, min_dur=MIN_DUR, max_dur=MAX_DUR, fft=FFT, hop_length=HOP_LEN, amp_threshold=AMP_THESHOLD, groupName=groupName, cacheDir=CACHE_DIR, features=True)
 
     # if too many samples, take the ones with the most power
     if SAMPLES is not None and len(sampleData) > SAMPLES:
@@ -91,40 +133,82 @@ def doTSNE(fn):
 
     featureData = []
     for d in sampleData:
-        ysample = ysamples[d["index"]]
-        featureVector = getFeatures(ysample, sr)
         featureData.append({
             "parent": basename,
             "group": groupName,
             "note": d["note"],
             "start": d["start"],
             "dur": d["dur"],
-            "featureVector": featureVector
+            "featureVector": d["featureVector"]
         })
 
-    progress += 1
-    sys.stdout.write('\r')
-    sys.stdout.write("%s%%" % round(1.0*progress/fileCount*100,1))
-    sys.stdout.flush()
-
     return featureData
 
 # files = files[:1]
 # for fn in files:
 #     doTSNE(fn)
-pool = ThreadPool()
-data = pool.map(doTSNE, files)
-pool.close()
-pool.join()
+results = runPool(doTSNE, files, workers=WORKERS, chunksize=CHUNK_SIZE, timeout=TIMEOUT) if len(files) > 0 else []
 # sys.exit(1)
 
-data = [item for sublist in data for item in sublist]
-featureVectors = [d["featureVector"] for d in data]
-model = TSNE(n_components=2,
-             learning_rate=150, # increase if too dense, decrease if too uniform
-             verbose=1,
-             angle=0.1 # increase to make faster, decrease to make more accurate
-).fit_transform(featureVectors)
+items = [item for sublist in results if sublist is not None for item in sublist]
+data = dict([(key, np.array([d[key] for d in items])) for key in FEATURE_COLUMNS])
+featureVectors = np.array([d["featureVector"] for d in items], dtype=np.float32)
+
+if STORE:
+    # keep stored vectors of files that weren't processed again
+    processed = set([getParentKey(fn) for fn in files])
+    if storedVectors is not None:
+        keep = [i for i, key in enumerate(getFeatureKeys(storedData)) if key not in processed]
+        keptData, keptVectors = selectFeatures(storedData, storedVectors, keep)
+        print("%s stored feature vectors reused" % len(keep))
+        if len(items) > 0:
+            data = dict([(key, np.concatenate((keptData[key], data[key]))) for key in FEATURE_COLUMNS])
+            featureVectors = np.concatenate((keptVectors.astype(np.float32), featureVectors))
+        else:
+            data, featureVectors = (keptData, keptVectors.astype(np.float32))
+
+    if len(files) > 0:
+        for fn, result in zip(files, results):
+            key = getManifestKey(fn)
+            # files that failed are processed again next time
+            if result is None:
+                manifest.pop(key, None)
+            else:
+                manifest[key] = manifestEntries[key]
+        writeFeatures(FEATURE_DIR, data, featureVectors, params, manifest, dtype=DTYPE)
+
+    # the store may hold files that aren't part of this run
+    inputKeys = set([getParentKey(fn) for fn in inputFiles])
+    indices = [i for i, key in enumerate(getFeatureKeys(data)) if key in inputKeys]
+    data, featureVectors = selectFeatures(data, featureVectors, indices)
+
+if PLACE:
+    if not os.path.isfile(EMBEDDING_FILE):
+        print("No saved embedding at %s; run without -place first" % EMBEDDING_FILE)
+        sys.exit(1)
+    saved = readEmbedding(EMBEDDING_FILE)
+    # samples of files that are already in the map stay where they are
+    savedKeys = set(getFeatureKeys(saved))
+    indices = [i for i, key in enumerate(getFeatureKeys(data)) if key not in savedKeys]
+    data, featureVectors = selectFeatures(data, featureVectors, indices)
+    if len(featureVectors) <= 0:
+        print("No new samples to place")
+        sys.exit(0)
+    newModel = placeEmbedding(saved["embedding"], saved["vectors"], featureVectors, seed=SEED)
+    bounds = saved["bounds"]
+    # keep the existing normalization, so existing points keep their positions in the csv and ui
+    modelNorm = normalizeEmbedding(newModel, bounds)
+    model = np.concatenate((saved["embedding"], newModel))
+    embeddingData = dict([(key, np.concatenate((saved[key], data[key]))) for key in FEATURE_COLUMNS])
+    embeddingVectors = np.concatenate((saved["vectors"], featureVectors))
+    highlight = np.concatenate((np.zeros(len(saved["embedding"]), dtype=int), np.ones(len(newModel), dtype=int)))
+
+else:
+    model = getEmbedding(featureVectors, method=EMBED_METHOD, pca=PCA_COMPONENTS, learningRate=LEARNING_RATE, angle=ANGLE, perplexity=PERPLEXITY, seed=SEED, threads=THREADS)
+    bounds = getEmbeddingBounds(model)
+    modelNorm = normalizeEmbedding(model, bounds)
+    embeddingData, embeddingVectors = (data, featureVectors)
+    highlight = None
 
 print("%s samples found." % len(featureVectors))
 x = model[:,0]
@@ -133,28 +217,28 @@ y = model[:,1]
 if SAVE_DATA:
     print("Writing data to file...")
     headings = ["parent", "group", "start", "dur", "x", "y"]
-
-    # normalize data
-    minX = np.min(x)
-    maxX = np.max(x)
-    minY = np.min(y)
-    maxY = np.max(y)
-    x_norm = (x - minX) / (maxX - minX)
-    y_norm = (y - minY) / (maxY - minY)
+    x_norm = modelNorm[:,0]
+    y_norm = modelNorm[:,1]
     precision = 5
 
-    with open(OUTPUT_FILE, 'wb') as f:
+    # placed samples are appended to the existing rows
+    with open(OUTPUT_FILE, 'ab' if PLACE else 'wb') as f:
         writer = csv.writer(f)
-        writer.writerow(headings)
-        for i, d in enumerate(data):
-            writer.writerow([d["parent"], d["group"], d["start"], d["dur"], round(x_norm[i], precision), round(y_norm[i], precision)])
-    print("Wrote %s rows to %s" % (len(data), OUTPUT_FILE))
+        if not PLACE:
+            writer.writerow(headings)
+        for i in range(len(featureVectors)):
+            writer.writerow([data["parent"][i], data["group"][i], data["start"][i], data["dur"][i], round(x_norm[i], precision), round(y_norm[i], precision)])
+    print("Wrote %s rows to %s" % (len(featureVectors), OUTPUT_FILE))
+
+    # the raw embedding and its feature vectors, so new samples can be placed into it later
+    writeEmbedding(EMBEDDING_FILE, model, embeddingData, embeddingVectors, bounds)
 
 if PLOT:
     plt.figure(figsize = (10,10))
-    if len(HIGHLIGHT) > 0:
-        values = list(set([d[HIGHLIGHT] for d in data]))
-        colors = [values.index(d[HIGHLIGHT]) for d in data]
+    if highlight is not None:
+        plt.scatter(x, y, c=highlight)
+    elif len(HIGHLIGHT) > 0:
+        values, colors = np.unique(data[HIGHLIGHT], return_inverse=True)
         plt.scatter(x, y, c=colors)
     else:
         plt.scatter(x, y)
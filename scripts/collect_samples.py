@@ -2,27 +2,30 @@
 
 # Combines audio samples into single audio and manifest file
 # Adapted from: https://github.com/kylemcdonald/AudioNotebooks/blob/master/Collect%20Samples.ipynb
+# Usage:
+    # python collect_samples.py -in "../audio/output/birds/*.wav" -out ../audio/output/bird_collection_%s.mp3
+    # python collect_samples.py -in "../audio/output/birds/*.wav" -out ../audio/output/bird_collection_%s.mp3,../audio/output/bird_collection_%s.ogg
 
 import argparse
 import glob
 import os
 from os.path import join
-from pydub import AudioSegment
 from pprint import pprint
 import sys
+from utils import getAudioInfo, readAudioRange, writeMixBlocks
 
 # input
 parser = argparse.ArgumentParser()
 parser.add_argument('-in', dest="INPUT_FILES", default="../audio/output/birds/*.wav", help="Input file pattern")
 parser.add_argument('-per', dest="SAMPLES_PER_FILE", default=100, type=int, help="Number of samples to combine into a single audio file")
-parser.add_argument('-out', dest="OUTPUT_FILE", default="../audio/output/bird_collection_%s.mp3", help="Output file pattern")
+parser.add_argument('-out', dest="OUTPUT_FILE", default="../audio/output/bird_collection_%s.mp3", help="Output file pattern, or comma-separated patterns to encode at once")
 parser.add_argument('-overwrite', dest="OVERWRITE", default=0, type=int, help="Overwrite existing audio/data?")
 args = parser.parse_args()
 
 # Parse arguments
 INPUT_FILES = args.INPUT_FILES
 SAMPLES_PER_FILE = args.SAMPLES_PER_FILE
-OUTPUT_FILE = args.OUTPUT_FILE
+OUTPUT_FILES = [fn.strip() for fn in args.OUTPUT_FILE.split(",") if len(fn.strip()) > 0]
 OVERWRITE = args.OVERWRITE > 0
 
 # Read files
@@ -31,35 +34,48 @@ fileCount = len(files)
 print("Found %s files" % fileCount)
 
 # Make sure output dirs exist
-outDir = os.path.dirname(OUTPUT_FILE)
-if not os.path.exists(outDir):
-    os.makedirs(outDir)
+for outFile in OUTPUT_FILES:
+    outDir = os.path.dirname(outFile)
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+
+def readSamples(samples, frameRate, channels):
+    # one sample at a time, so the combined audio is never held in memory
+    for fn in samples:
+        yield readAudioRange(fn, sr=frameRate, channels=channels)
 
 i0 = 0
 i1 = SAMPLES_PER_FILE
 
 i = 1
+failedCount = 0
 while i0 < fileCount:
     i1 = min(i1, fileCount)
     samples = files[i0:i1]
-    outFn = OUTPUT_FILE % str(i).zfill(2)
-
-    if OVERWRITE or not os.path.isfile(outFn):
-        print("Building %s..." % outFn)
-        audio = AudioSegment.empty()
+    outFns = [outFile % str(i).zfill(2) for outFile in OUTPUT_FILES]
 
-        for fn in samples:
-            audio += AudioSegment.from_wav(fn)
-        # audio /= audio.max # normalize
+    if OVERWRITE or not all([os.path.isfile(outFn) for outFn in outFns]):
+        print("Building %s..." % ", ".join(outFns))
 
-        # if MP3, write wav first, then convert to mp3 with ffmpeg
-        format = outFn.split(".")[-1]
-        file_handle = audio.export(outFn, format=format)
+        # match the highest frame rate and channel count in the group, like pydub does when appending
+        info = [getAudioInfo(fn) for fn in samples]
+        frameRate = max([rate for rate, channels in info])
+        channels = max([channels for rate, channels in info])
 
-        print("Wrote %s to file" % outFn)
+        # pcm is piped straight to one encoder per output instead of exporting a temporary wav first
+        try:
+            writeMixBlocks(readSamples(samples, frameRate, channels), outFns, frameRate, channels)
+            print("Wrote %s to file" % ", ".join(outFns))
+        except IOError as e:
+            print(e)
+            failedCount += 1
 
     i0 += SAMPLES_PER_FILE
     i1 += SAMPLES_PER_FILE
     i += 1
 
+if failedCount > 0:
+    print "Failed to write %s of %s groups." % (failedCount, i-1)
+    sys.exit(1)
+
 print "Done."
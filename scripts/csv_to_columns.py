@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+# Converts a data csv file (samples, phrases, stats, t-SNE) to a column store that loads memory-mapped
+# Usage:
+    # python csv_to_columns.py -in ../data/output/birds_audio_samples.csv
+    # python mix_sort.py -sample ../data/output/birds_audio_samples.cols
+    # python csv_to_columns.py -in ../data/output/birds_audio_phrases.csv
+    # python phrases_stats.py -in ../data/output/birds_audio_phrases.cols
+
+import argparse
+import csv
+import os
+import sys
+from utils import readCsv, readPhrases, writeColumns, writePhrases
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audio_samples.csv", help="Input csv file")
+parser.add_argument('-out', dest="OUTPUT_DIR", default="", help="Output column store directory, defaults to the input file with .cols")
+args = parser.parse_args()
+
+INPUT_FILE = args.INPUT_FILE
+OUTPUT_DIR = args.OUTPUT_DIR if len(args.OUTPUT_DIR) > 0 else os.path.splitext(args.INPUT_FILE)[0] + ".cols"
+
+print("Reading data file...")
+rows = readCsv(INPUT_FILE)
+rowCount = len(rows)
+print("Found %s rows in %s" % (rowCount, INPUT_FILE))
+
+if rowCount <= 0:
+    print("No rows to convert")
+    sys.exit(1)
+
+# keep the csv column order
+headings = None
+with open(INPUT_FILE, 'rb') as f:
+    for line in f:
+        if not line.startswith("#"):
+            headings = next(csv.reader([line], skipinitialspace=True))
+            break
+
+# phrases are stored as a flat note table plus offsets
+if "phrase" in headings:
+    writePhrases(OUTPUT_DIR, readPhrases(INPUT_FILE))
+else:
+    writeColumns(OUTPUT_DIR, rows, headings)
@@ -20,7 +20,7 @@ SHOW_TOP = args.SHOW_TOP
 OUTPUT_FILE = args.OUTPUT_FILE
 
 print("Reading data file...")
-data = readCsv(INPUT_FILE)
+data = readCsv(INPUT_FILE, schema="metadata")
 rowCount = len(data)
 print("Found %s rows in %s" % (rowCount, INPUT_FILE))
 
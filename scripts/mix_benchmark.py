@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+# Times mix_audio.py on synthetic mixes of increasing size, to size render jobs and catch regressions
+# Usage:
+    # python -W ignore mix_benchmark.py
+    # python -W ignore mix_benchmark.py -events 1000,10000 -clips 10,100 -reverb 0 -out ../data/output/mix_benchmark_quick.json
+# Output json: machine info, then one run per (events, clips, reverb, fades) with
+# wall time (s), peak resident memory (MB) and realtime factor (seconds of mix rendered per second)
+
+import argparse
+import json
+import math
+import multiprocessing
+import numpy as np
+import os
+import platform
+from pprint import pprint
+from scipy.io import wavfile
+import subprocess
+import sys
+import time
+from utils import getReverbDuration, writeMixFile
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-events', dest="EVENT_COUNTS", default="1000,10000,100000,1000000", help="Comma-separated event counts")
+parser.add_argument('-clips', dest="CLIP_COUNTS", default="10,100,1000,10000", help="Comma-separated counts of distinct clips")
+parser.add_argument('-reverb', dest="REVERBS", default="0,50", help="Comma-separated reverb amounts (0-100)")
+parser.add_argument('-fades', dest="FADES", default="0,1", help="Comma-separated, 1 to give every event a fade in and out")
+parser.add_argument('-density', dest="DENSITY", default=50.0, type=float, help="Events per second of mix")
+parser.add_argument('-sounds', dest="SOUND_COUNT", default=10, type=int, help="Number of synthetic source wavs the clips are cut from")
+parser.add_argument('-ext', dest="EXT", default="wav", help="Output audio format, e.g. wav or mp3")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Passed to mix_audio.py")
+parser.add_argument('-dir', dest="WORK_DIR", default="../data/cache/mix_benchmark/", help="Directory for synthetic audio, mix files and renders")
+parser.add_argument('-keep', dest="KEEP", default=0, type=int, help="Keep rendered audio?")
+parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/mix_benchmark.json", help="Output json file")
+args = parser.parse_args()
+
+EVENT_COUNTS = [int(v) for v in args.EVENT_COUNTS.split(",")]
+CLIP_COUNTS = [int(v) for v in args.CLIP_COUNTS.split(",")]
+REVERBS = [int(v) for v in args.REVERBS.split(",")]
+FADES = [int(v) > 0 for v in args.FADES.split(",")]
+DENSITY = args.DENSITY
+SOUND_COUNT = args.SOUND_COUNT
+EXT = args.EXT
+WORKERS = args.WORKERS
+WORK_DIR = os.path.abspath(args.WORK_DIR)
+KEEP = args.KEEP > 0
+OUTPUT_FILE = args.OUTPUT_FILE
+
+FRAME_RATE = 44100
+CLIP_DUR = 500
+CLIP_STEP = 50
+FADE_IN_DUR = 20
+FADE_OUT_DUR = 200
+# mix_audio.py defaults
+PAD_LEFT = 3000
+PAD_RIGHT = 3000
+SEED = 1
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+AUDIO_DIR = os.path.join(WORK_DIR, "audio")
+
+# Make sure output dirs exist
+for d in [AUDIO_DIR, os.path.dirname(os.path.abspath(OUTPUT_FILE))]:
+    if not os.path.exists(d):
+        os.makedirs(d)
+
+def getMaxRss(usage):
+    # linux reports kilobytes, mac reports bytes
+    kb = usage.ru_maxrss / 1024.0 if sys.platform == "darwin" else usage.ru_maxrss
+    return round(kb / 1024.0, 1)
+
+def makeMix(filename, eventCount, clipCount, fades):
+    rng = np.random.RandomState(SEED)
+    clips = np.arange(eventCount) % clipCount
+    rng.shuffle(clips)
+    starts = np.round(np.arange(eventCount) * 1000.0 / DENSITY + rng.uniform(0, 1000.0 / DENSITY, eventCount)).astype(int)
+    volumes = np.round(rng.uniform(0.2, 1.0, eventCount), 3)
+    pans = np.round(rng.uniform(-1.0, 1.0, eventCount), 3)
+    instructions = []
+    for i in range(eventCount):
+        clip = clips[i]
+        instructions.append({
+            "sound": "bench_%s" % (clip % SOUND_COUNT),
+            "start": starts[i],
+            # each clip is a distinct window of a source sound
+            "clipStart": (clip // SOUND_COUNT) * CLIP_STEP,
+            "clipDur": CLIP_DUR,
+            "volume": volumes[i],
+            "pan": pans[i],
+            "fadeIn": FADE_IN_DUR if fades else 0,
+            "fadeOut": FADE_OUT_DUR if fades else 0
+        })
+    writeMixFile(filename, instructions)
+    return (starts[-1] + CLIP_DUR) / 1000.0
+
+def makeSounds(dur):
+    # decaying sweeps with a little noise, long enough for every clip window
+    rng = np.random.RandomState(SEED)
+    frames = int(math.ceil(dur / 1000.0 * FRAME_RATE))
+    t = np.arange(frames) / float(FRAME_RATE)
+    for i in range(SOUND_COUNT):
+        fn = os.path.join(AUDIO_DIR, "bench_%s.wav" % i)
+        if os.path.isfile(fn) and len(wavfile.read(fn, mmap=True)[1]) >= frames:
+            continue
+        hz0, hz1 = rng.uniform(500.0, 8000.0, 2)
+        sweepDur = CLIP_DUR / 1000.0
+        phase = 2.0 * np.pi * (hz0 * (t % sweepDur) + (hz1 - hz0) * (t % sweepDur)**2 / (2.0 * sweepDur))
+        y = np.sin(phase) * np.exp(-4.0 * (t % sweepDur) / sweepDur) + rng.normal(0, 0.01, frames)
+        wavfile.write(fn, FRAME_RATE, (np.clip(y * 0.5, -1.0, 1.0) * 32767).astype(np.int16))
+    print("Wrote %s synthetic sounds of %ss to %s" % (SOUND_COUNT, round(dur / 1000.0, 1), AUDIO_DIR))
+
+def runMix(mixFilename, outFilename, reverb):
+    command = [sys.executable, "-W", "ignore", "mix_audio.py", "-in", mixFilename, "-dir", os.path.join(AUDIO_DIR, "%s.wav"), "-out", outFilename, "-reverb", str(reverb), "-cache", "", "-workers", str(WORKERS)]
+    with open(os.path.splitext(outFilename)[0] + ".log", 'w') as log:
+        t0 = time.time()
+        process = subprocess.Popen(command, cwd=SCRIPT_DIR, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 returns the usage of this run alone, including the ffmpeg processes it waited for
+        pid, status, usage = os.wait4(process.pid, 0)
+        wall = time.time() - t0
+    return (wall, getMaxRss(usage), os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1)
+
+def writeResults(filename, results):
+    # rewritten after every run so a long benchmark can be stopped early
+    tmpFilename = filename + ".tmp"
+    with open(tmpFilename, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    os.rename(tmpFilename, filename)
+
+cases = [(e, c) for e in EVENT_COUNTS for c in CLIP_COUNTS if c <= e]
+if len(cases) <= 0:
+    print("No cases to run; clip counts must not exceed event counts")
+    sys.exit(1)
+
+maxClips = max([c for e, c in cases])
+makeSounds(int(math.ceil(1.0 * maxClips / SOUND_COUNT)) * CLIP_STEP + CLIP_DUR)
+
+results = {
+    "machine": {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__
+    },
+    "params": {
+        "density": DENSITY,
+        "sounds": SOUND_COUNT,
+        "clipDur": CLIP_DUR,
+        "ext": EXT,
+        "workers": WORKERS
+    },
+    "runs": []
+}
+
+runCount = len(cases) * len(FADES) * len(REVERBS)
+i = 0
+for eventCount, clipCount in cases:
+    for fades in FADES:
+        mixFilename = os.path.join(WORK_DIR, "mix_e%s_c%s_f%s.txt" % (eventCount, clipCount, int(fades)))
+        eventsDur = makeMix(mixFilename, eventCount, clipCount, fades)
+
+        for reverb in REVERBS:
+            i += 1
+            outFilename = os.path.join(WORK_DIR, "mix_e%s_c%s_f%s_r%s.%s" % (eventCount, clipCount, int(fades), reverb, EXT))
+            mixDur = PAD_LEFT / 1000.0 + eventsDur + (PAD_RIGHT + (getReverbDuration(FRAME_RATE, reverb) if reverb > 0 else 0)) / 1000.0
+            print("[%s/%s] %s events, %s clips, fades %s, reverb %s (%ss of audio)..." % (i, runCount, eventCount, clipCount, int(fades), reverb, round(mixDur, 1)))
+
+            wall, maxRss, returncode = runMix(mixFilename, outFilename, reverb)
+            run = {
+                "events": eventCount,
+                "clips": clipCount,
+                "fades": fades,
+                "reverb": reverb,
+                "mixDur": round(mixDur, 3),
+                "wall": round(wall, 3),
+                "maxRssMB": maxRss,
+                "realtime": round(mixDur / wall, 2) if wall > 0 and returncode == 0 else None,
+                "returncode": returncode
+            }
+            if returncode != 0:
+                print("  mix_audio.py exited with code %s, see %s" % (returncode, os.path.splitext(outFilename)[0] + ".log"))
+            else:
+                print("  %ss wall, %sMB peak, %sx realtime" % (run["wall"], run["maxRssMB"], run["realtime"]))
+            results["runs"].append(run)
+            writeResults(OUTPUT_FILE, results)
+
+            if not KEEP and os.path.isfile(outFilename):
+                os.remove(outFilename)
+
+print("Wrote %s runs to %s" % (len(results["runs"]), OUTPUT_FILE))
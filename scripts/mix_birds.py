@@ -39,10 +39,10 @@ VARIANCE_MS = 10 # +/- milliseconds an instrument note should be off by to give
 seedPos = 0
 
 print("Reading data file...")
-metaData = readCsv(INPUT_META_FILE)
-sampleData = readCsv(INPUT_SAMPLE_FILE)
-phraseStats = readCsv(INPUT_PHRASE_STATS_FILE)
-chordData = readCsv(INPUT_CHORDS_FILE)
+metaData = readCsv(INPUT_META_FILE, schema="metadata")
+sampleData = readCsv(INPUT_SAMPLE_FILE, schema="samples")
+phraseStats = readCsv(INPUT_PHRASE_STATS_FILE, schema="phrase_stats")
+chordData = readCsv(INPUT_CHORDS_FILE, schema="chords")
 
 # add note-octave to smapleData
 for i, d in enumerate(sampleData):
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# Checks that rendering an excerpt of a mix (mix_audio.py -s0/-s1) gives the same audio as slicing the full render,
+# with a reverb whose tail is longer than the old fixed 3s preroll
+# Usage:
+    # python mix_excerpt_tests.py
+    # python mix_excerpt_tests.py -reverb 50 -events 500
+
+import argparse
+import numpy as np
+import sys
+from utils import applyReverbBlock, getReverbDuration, makeMixBuffer, msToFrames, renderMixBlocks, selectMixWindow
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-reverb', dest="REVERB", default=100, type=int, help="Reverb (0-100); 75 and up rings for more than 3s")
+parser.add_argument('-events', dest="EVENT_COUNT", default=200, type=int, help="Number of synthetic events")
+parser.add_argument('-clips', dest="CLIP_COUNT", default=20, type=int, help="Number of distinct synthetic clips")
+parser.add_argument('-dur', dest="DUR", default=30000, type=int, help="Events are spread over this many ms")
+parser.add_argument('-seed', dest="SEED", default=1, type=int, help="Seed for the synthetic mix")
+args = parser.parse_args()
+
+REVERB = args.REVERB
+EVENT_COUNT = args.EVENT_COUNT
+CLIP_COUNT = args.CLIP_COUNT
+DUR = args.DUR
+SEED = args.SEED
+
+FRAME_RATE = 22050
+BLOCK_DUR = 5000
+PAD_RIGHT = 3000
+TOLERANCE = 1e-4
+
+# Excerpts as (start, end) in ms, including one that ends after the mix does
+EXCERPTS = [
+    (1000, 4000),
+    (DUR // 3, DUR // 3 + 2000),
+    (DUR // 2, DUR),
+    (DUR - 500, DUR + 20000)
+]
+
+# Synthetic clips: decaying noise of different lengths
+rand = np.random.RandomState(SEED)
+clipDurs = rand.randint(100, 2000, CLIP_COUNT)
+clips = []
+for dur in clipDurs:
+    frames = msToFrames(int(dur), FRAME_RATE)
+    decay = np.exp(-4.0 * np.arange(frames) / frames)[:, np.newaxis]
+    clips.append((rand.uniform(-0.5, 0.5, (frames, 2)) * decay).astype(np.float32))
+
+# A plan like compileMix returns, sorted by start
+starts = np.sort(rand.randint(0, DUR, EVENT_COUNT)).astype(np.int64)
+plan = {
+    "clipSound": np.arange(CLIP_COUNT, dtype=np.int32),
+    "clipStart": np.zeros(CLIP_COUNT, dtype=np.int64),
+    "clipDur": clipDurs.astype(np.int64),
+    "start": starts,
+    "clip": rand.randint(0, CLIP_COUNT, EVENT_COUNT).astype(np.int32),
+    "gain": rand.uniform(0.2, 1.0, EVENT_COUNT).astype(np.float32),
+    "pan": rand.uniform(-1.0, 1.0, EVENT_COUNT).astype(np.float32),
+    "fadeIn": np.zeros(EVENT_COUNT, dtype=np.int64),
+    "fadeOut": rand.randint(0, 200, EVENT_COUNT).astype(np.int64),
+    "send": rand.uniform(0.0, 1.0, EVENT_COUNT).astype(np.float32)
+}
+
+def getClips(clipIds):
+    return [clips[clipId] for clipId in clipIds]
+
+def reverbBus(block, tail):
+    return applyReverbBlock(block, FRAME_RATE, tail, reverberance=REVERB)
+
+def render(plan, padRight, startFrame=0, endFrame=-1, preroll=0):
+    effect = reverbBus if REVERB > 0 else None
+    blocks = list(renderMixBlocks(plan, getClips, FRAME_RATE, blockFrames=msToFrames(BLOCK_DUR, FRAME_RATE), padRight=msToFrames(padRight, FRAME_RATE), effect=effect, startFrame=startFrame, endFrame=endFrame, preroll=msToFrames(preroll, FRAME_RATE), showProgress=False))
+    return np.concatenate(blocks) if len(blocks) > 0 else makeMixBuffer(0)
+
+def renderExcerpt(start, end, preroll, padRight):
+    excerpt = selectMixWindow(plan, start, end, preroll)
+    return render(excerpt, padRight, msToFrames(start, FRAME_RATE), msToFrames(end, FRAME_RATE), preroll)
+
+def getDifference(a, b):
+    if len(a) != len(b):
+        return np.inf
+    return np.max(np.abs(a - b)) if len(a) > 0 else 0.0
+
+reverbDur = getReverbDuration(FRAME_RATE, REVERB) if REVERB > 0 else 0
+padRight = PAD_RIGHT + reverbDur
+print("Reverb %s rings for %sms" % (REVERB, reverbDur))
+
+full = render(plan, padRight)
+print("Rendered full mix of %ss" % round(1.0 * len(full) / FRAME_RATE, 3))
+
+failures = 0
+for start, end in EXCERPTS:
+    expected = full[msToFrames(start, FRAME_RATE):msToFrames(end, FRAME_RATE)]
+    difference = getDifference(renderExcerpt(start, end, reverbDur, padRight), expected)
+    # what a fixed 3s preroll would have cut off, for reference
+    fixedDifference = getDifference(renderExcerpt(start, end, min(3000, reverbDur), padRight), expected)
+    passed = difference <= TOLERANCE
+    if not passed:
+        failures += 1
+    print("%s excerpt %s-%sms: max difference %s (%s with a 3s preroll)" % ("OK  " if passed else "FAIL", start, end, difference, fixedDifference))
+
+if failures > 0:
+    print("%s of %s excerpts differ from the full render" % (failures, len(EXCERPTS)))
+    sys.exit(1)
+print("All %s excerpts match the full render" % len(EXCERPTS))
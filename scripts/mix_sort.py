@@ -2,15 +2,16 @@
 
 import argparse
 import csv
+import numpy as np
 import os
 from pprint import pprint
 import sys
 import time
-from utils import readCsv, norm, writeMixFile
+from utils import loadColumns, norm, writeMixFile
 
 # input
 parser = argparse.ArgumentParser()
-parser.add_argument('-sample', dest="INPUT_SAMPLE_FILE", default="../data/output/birds_audio_samples.csv", help="Input samples csv file")
+parser.add_argument('-sample', dest="INPUT_SAMPLE_FILE", default="../data/output/birds_audio_samples.csv", help="Input samples csv file or column store")
 parser.add_argument('-sort', dest="SORT_BY", default="hz", help="Possible values: hz, power, dur")
 parser.add_argument('-low', dest="MIN_VALUE", default=400.0, type=float, help="Possible values: hz, power, dur")
 parser.add_argument('-high', dest="MAX_VALUE", default=2000.0, type=float, help="Possible values: hz, power, dur")
@@ -25,29 +26,33 @@ OUTPUT_FILE = args.OUTPUT_FILE
 OVERLAP = 0.25
 
 print("Reading data file...")
-sampleData = readCsv(INPUT_SAMPLE_FILE)
-print("Found %s rows in %s" % (len(sampleData), INPUT_SAMPLE_FILE))
-
-# filter values
-sampleData = [s for s in sampleData if MIN_VALUE <= s[SORT_BY] <= MAX_VALUE]
-
-# sort values
-sampleData = sorted(sampleData, key=lambda k: k[SORT_BY])
-values = [s[SORT_BY] for s in sampleData]
-print("%s range: [%s - %s]" % (SORT_BY, min(values), max(values)))
-
-totalDur = sum([int(s["dur"]*(1.0-OVERLAP)) for s in sampleData])
+sampleData = loadColumns(INPUT_SAMPLE_FILE, ["parent", "start", "dur", SORT_BY], schema="samples")
+values = sampleData[SORT_BY]
+print("Found %s rows in %s" % (len(values), INPUT_SAMPLE_FILE))
+
+# filter values, then sort them (stable, like sorted())
+indices = np.flatnonzero((MIN_VALUE <= values) & (values <= MAX_VALUE))
+indices = indices[np.argsort(values[indices], kind="mergesort")]
+values = values[indices]
+print("%s range: [%s - %s]" % (SORT_BY, values.min(), values.max()))
+
+parents = sampleData["parent"][indices].tolist()
+clipStarts = sampleData["start"][indices].astype(int)
+clipDurs = sampleData["dur"][indices].astype(int)
+
+# overlap the sounds a bit
+steps = (clipDurs * (1.0-OVERLAP)).astype(int)
+totalDur = int(steps.sum())
 print("Total time: %s" % time.strftime('%H:%M:%S', time.gmtime(totalDur/1000)))
+starts = np.cumsum(steps) - steps
 
 instructions = []
-start = 0
-for s in sampleData:
+for i, parent in enumerate(parents):
     instructions.append({
-        "start": start,
-        "sound": s["parent"],
-        "clipStart": s["start"],
-        "clipDur": s["dur"]
+        "start": int(starts[i]),
+        "sound": parent,
+        "clipStart": int(clipStarts[i]),
+        "clipDur": int(clipDurs[i])
     })
-    start += int(s["dur"] * (1.0-OVERLAP)) # overlap the sounds a bit
 
-writeMixFile(OUTPUT_FILE, parents, instructions)
+writeMixFile(OUTPUT_FILE, instructions)
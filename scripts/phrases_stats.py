@@ -9,7 +9,7 @@ import numpy as np
 import os
 from pprint import pprint
 import sys
-from utils import readCsv, norm
+from utils import getPhraseCount, getPhraseMeans, getPhrasePairs, getPhraseStds, norm, readPhrases, selectPhrases
 
 # input
 parser = argparse.ArgumentParser()
@@ -47,54 +47,51 @@ COLORS = {
     "C#": (217, 33, 32)
 }
 
+NOTES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+def roundInt(values):
+    # round half up like python's round() rather than numpy's round half to even
+    return np.floor(values + 0.5).astype(int)
+
 print("Reading data file...")
-data = readCsv(INPUT_FILE)
-rowCount = len(data)
+data = readPhrases(INPUT_FILE)
+rowCount = getPhraseCount(data)
 print("Found %s rows in %s" % (rowCount, INPUT_FILE))
 
-# entry keys: parent,start,dur,phrase
-# phrase keys: start,dur,power,hz,note,octave
-
-for i, entry in enumerate(data):
-    phrase = [v.split(":") for v in entry["phrase"].split(",")]
-    for j, v in enumerate(phrase):
-        phrase[j] = {
-            "start": int(v[0]),
-            "dur": int(v[1]),
-            "power": float(v[2]),
-            "hz": float(v[3]),
-            "note": v[4],
-            "octave": int(v[5]),
-        }
-    data[i]["phrase"] = phrase
+# entry keys: parent,start,dur + notes,offsets
+# note keys: start,dur,power,hz,note,octave
 
 # remove invalid phrases
-data = [d for d in data if d["dur"] >= MIN_DURATION and len(d["phrase"]) >= MIN_NOTES_PER_PHRASE]
-rowCount = len(data)
+counts = np.diff(data["offsets"])
+data = selectPhrases(data, np.flatnonzero((data["dur"] >= MIN_DURATION) & (counts >= MIN_NOTES_PER_PHRASE)))
+rowCount = getPhraseCount(data)
 print("Found %s valid rows in %s" % (rowCount, INPUT_FILE))
 
-# calculate standard deviations for frequency and rhythms
-for i, entry in enumerate(data):
-    hzs = []
-    durs = []
-    pows = []
-    deltas = []
-    phrase = entry["phrase"]
-    for j, note in enumerate(phrase):
-        hzs.append(note["hz"])
-        durs.append(note["dur"])
-        pows.append(note["power"])
-        if j > 0:
-            deltas.append(note["start"]-phrase[j-1]["start"])
-    data[i]["count"] = len(phrase)
-    data[i]["hzMean"] = int(round(np.mean(hzs)))
-    data[i]["durMean"] = int(round(np.mean(durs)))
-    data[i]["powMean"] = round(np.mean(pows), 1)
-    data[i]["hzStd"] = int(round(np.std(hzs)))
-    data[i]["beatStd"] = int(round((np.std(durs) + np.std(deltas)) * 0.5))
-    data[i]["notes"] = "".join(list(set([n["note"] for n in phrase])))
-
-maxDur = max([d["dur"] for d in data])
+# calculate standard deviations for frequency and rhythms for all phrases at once
+offsets = data["offsets"]
+notes = data["notes"]
+prevIndices, nextIndices, deltaOffsets = getPhrasePairs(offsets)
+deltas = notes["start"][nextIndices] - notes["start"][prevIndices]
+data["count"] = np.diff(offsets)
+data["hzMean"] = roundInt(getPhraseMeans(offsets, notes["hz"]))
+data["durMean"] = roundInt(getPhraseMeans(offsets, notes["dur"]))
+data["powMean"] = np.array([round(v, 1) for v in getPhraseMeans(offsets, notes["power"]).tolist()])
+data["hzStd"] = roundInt(getPhraseStds(offsets, notes["hz"]))
+data["beatStd"] = roundInt((getPhraseStds(offsets, notes["dur"]) + getPhraseStds(deltaOffsets, deltas)) * 0.5)
+
+# unique notes of each phrase as a bit mask, then one string per distinct mask
+noteValues = np.asarray(notes["note"], dtype=str)
+known = np.isin(noteValues, NOTES)
+if not np.all(known):
+    print("Leaving %s notes that are not one of %s out of the note strings" % (np.count_nonzero(~known), ",".join(NOTES)))
+noteOrder = np.argsort(NOTES)
+noteBits = np.zeros(len(noteValues), dtype=int)
+noteBits[known] = np.left_shift(1, noteOrder[np.searchsorted(np.array(NOTES)[noteOrder], noteValues[known])])
+masks = np.bitwise_or.reduceat(noteBits, offsets[:-1]) if rowCount > 0 else np.zeros(0, dtype=int)
+maskStrings = dict([(mask, "".join([n for j, n in enumerate(NOTES) if mask & (1 << j)])) for mask in np.unique(masks).tolist()])
+noteStrings = np.array([maskStrings[mask] for mask in masks.tolist()])
+
+maxDur = np.max(data["dur"])
 print("Max duration is %sms" % maxDur)
 
 if DRAW_IMAGE:
@@ -105,16 +102,18 @@ if DRAW_IMAGE:
     im = Image.new(mode="RGB", size=(IMAGE_WIDTH, IMAGE_HEIGHT), color="white")
 
     draw = ImageDraw.Draw(im)
-    for i, entry in enumerate(data):
+    for i in range(rowCount):
         y0 = i * ROW_HEIGHT
         y1 = (i+1) * ROW_HEIGHT
-        start = entry["start"]
-        end = entry["start"]+entry["dur"]
-        width = 1.0 * entry["dur"] / maxDur * IMAGE_WIDTH
-        for note in entry["phrase"]:
-            color = COLORS[note["note"]]
-            x0 = norm(note["start"], (start, end)) * width
-            x1 = norm(note["start"]+note["dur"], (start, end)) * width
+        start = data["start"][i]
+        end = data["start"][i]+data["dur"][i]
+        width = 1.0 * data["dur"][i] / maxDur * IMAGE_WIDTH
+        for j in range(offsets[i], offsets[i+1]):
+            if not known[j]:
+                continue
+            color = COLORS[noteValues[j]]
+            x0 = norm(notes["start"][j], (start, end)) * width
+            x1 = norm(notes["start"][j]+notes["dur"][j], (start, end)) * width
             draw.rectangle([x0, y0, x1, y1], fill=color, outline="white")
         sys.stdout.write('\r')
         sys.stdout.write("%s%%" % round(1.0*(i+1)/rowCount*100,1))
@@ -129,11 +128,8 @@ headings = ["parent", "start", "dur", "count", "hzMean", "durMean", "powMean", "
 with open(OUTPUT_FILE, 'wb') as f:
     writer = csv.writer(f)
     writer.writerow(headings)
-    rows = []
-    for entry in data:
-        row = []
-        for key in headings:
-            row.append(entry[key])
-        rows.append(row)
+    # the notes column holds each phrase's note string; data["notes"] stays the note table
+    columns = [data[key] for key in headings[:-1]] + [noteStrings]
+    rows = zip(*[values.tolist() for values in columns])
     writer.writerows(rows)
     print "Wrote %s rows to %s" % (len(rows), OUTPUT_FILE)
@@ -5,15 +5,12 @@ import csv
 import glob
 import json
 from matplotlib import pyplot as plt
-from multiprocessing import Pool
-from multiprocessing.dummy import Pool as ThreadPool
 import os
 from os.path import join
 import numpy as np
 from pprint import pprint
-from sklearn.manifold import TSNE
 import sys
-from utils import readCsv
+from utils import getEmbedding, getPhraseCount, getPhraseMeans, getPhrasePairs, getPhraseStds, readPhrases
 
 # input
 parser = argparse.ArgumentParser()
@@ -21,6 +18,13 @@ parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audi
 parser.add_argument('-plot', dest="PLOT", default=0, type=int, help="Show plot?")
 parser.add_argument('-highlight', dest="HIGHLIGHT", default="notes", help="What to highlight: notes, files")
 parser.add_argument('-saved', dest="SAVE_DATA", default=0, type=int, help="Save data files?")
+parser.add_argument('-embed', dest="EMBED_METHOD", default="tsne", help="Embedding: auto, tsne, opentsne, multicore, umap, pca")
+parser.add_argument('-pca', dest="PCA_COMPONENTS", default=-1, type=int, help="Reduce features to this many components before embedding, -1 to keep all")
+parser.add_argument('-lr', dest="LEARNING_RATE", default=150.0, type=float, help="t-SNE learning rate, -1 to scale with sample count")
+parser.add_argument('-angle', dest="ANGLE", default=0.1, type=float, help="Barnes-Hut angle (tsne, multicore); increase to make faster, decrease to make more accurate")
+parser.add_argument('-perplexity', dest="PERPLEXITY", default=30.0, type=float, help="t-SNE perplexity")
+parser.add_argument('-seed', dest="SEED", default=1, type=int, help="Random seed")
+parser.add_argument('-threads', dest="THREADS", default=-1, type=int, help="Embedding threads, -1 for all cores")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_phrases_tsne.csv", help="CSV output file")
 args = parser.parse_args()
 
@@ -30,28 +34,22 @@ PLOT = args.PLOT > 0
 HIGHLIGHT = args.HIGHLIGHT
 SAVE_DATA = args.SAVE_DATA > 0
 OUTPUT_FILE = args.OUTPUT_FILE
+EMBED_METHOD = args.EMBED_METHOD
+PCA_COMPONENTS = args.PCA_COMPONENTS
+LEARNING_RATE = args.LEARNING_RATE
+ANGLE = args.ANGLE
+PERPLEXITY = args.PERPLEXITY
+SEED = args.SEED
+THREADS = args.THREADS
 
 # Read files
 print("Reading data file...")
-data = readCsv(INPUT_FILE)
-rowCount = len(data)
+data = readPhrases(INPUT_FILE)
+rowCount = getPhraseCount(data)
 print("Found %s rows in %s" % (rowCount, INPUT_FILE))
 
-# entry keys: parent,start,dur,phrase
-# phrase keys: start,dur,power,hz,note,octave
-
-for i, entry in enumerate(data):
-    phrase = [v.split(":") for v in entry["phrase"].split(",")]
-    for j, v in enumerate(phrase):
-        phrase[j] = {
-            "start": int(v[0]),
-            "dur": int(v[1]),
-            "power": float(v[2]),
-            "hz": float(v[3]),
-            "note": v[4],
-            "octave": int(v[5]),
-        }
-    data[i]["phrase"] = phrase
+# entry keys: parent,start,dur + notes,offsets
+# note keys: start,dur,power,hz,note,octave
 
 # Make sure output dirs exist
 outDirs = [os.path.dirname(OUTPUT_FILE)]
@@ -59,56 +57,27 @@ for outDir in outDirs:
     if not os.path.exists(outDir):
         os.makedirs(outDir)
 
-def getFeatures(phrase):
-    feature_vector = []
-    hzs = [d["hz"] for d in phrase]
-    durs = [d["dur"] for d in phrase]
-    pows = [d["power"] for d in phrase]
-    rests = []
-    for j, d in enumerate(phrase):
-        if j > 0:
-            prev = phrase[j-1]
-            rests.append(d["start"]-(prev["start"]+prev["dur"]))
-    feature_vector.append(len(phrase))
-    feature_vector.append(np.mean(hzs))
-    feature_vector.append(np.mean(pows))
-    feature_vector.append(np.mean(durs))
-    feature_vector.append(np.mean(rests))
-    feature_vector.append(np.std(hzs))
-    feature_vector.append(np.std(pows))
-    feature_vector.append(np.std(durs))
-    feature_vector.append(np.std(rests))
-    # pprint(feature_vector)
-    return feature_vector
-
-progress = 0
-def doTSNE(row):
-    global progress
-    global rowCount
-
-    featureData = getFeatures(row["phrase"])
-
-    progress += 1
-    sys.stdout.write('\r')
-    sys.stdout.write("%s%%" % round(1.0*progress/rowCount*100,1))
-    sys.stdout.flush()
-
-    return featureData
-
-# data = data[:10]
-# for fn in files:
-#     doTSNE(fn)
-pool = ThreadPool()
-featureVectors = pool.map(doTSNE, data)
-pool.close()
-pool.join()
-# sys.exit(1)
-
-model = TSNE(n_components=2,
-             learning_rate=150, # increase if too dense, decrease if too uniform
-             verbose=1,
-             angle=0.1 # increase to make faster, decrease to make more accurate
-).fit_transform(featureVectors)
+def getFeatures(data):
+    # one feature vector per phrase, computed over the flat note table
+    offsets = data["offsets"]
+    notes = data["notes"]
+    prevIndices, nextIndices, restOffsets = getPhrasePairs(offsets)
+    rests = notes["start"][nextIndices] - (notes["start"][prevIndices] + notes["dur"][prevIndices])
+    return np.column_stack([
+        np.diff(offsets),
+        getPhraseMeans(offsets, notes["hz"]),
+        getPhraseMeans(offsets, notes["power"]),
+        getPhraseMeans(offsets, notes["dur"]),
+        getPhraseMeans(restOffsets, rests),
+        getPhraseStds(offsets, notes["hz"]),
+        getPhraseStds(offsets, notes["power"]),
+        getPhraseStds(offsets, notes["dur"]),
+        getPhraseStds(restOffsets, rests)
+    ])
+
+featureVectors = getFeatures(data)
+
+model = getEmbedding(featureVectors, method=EMBED_METHOD, pca=PCA_COMPONENTS, learningRate=LEARNING_RATE, angle=ANGLE, perplexity=PERPLEXITY, seed=SEED, threads=THREADS)
 
 x = model[:,0]
 y = model[:,1]
@@ -129,8 +98,8 @@ if SAVE_DATA:
     with open(OUTPUT_FILE, 'wb') as f:
         writer = csv.writer(f)
         writer.writerow(headings)
-        for i, d in enumerate(data):
-            writer.writerow([d["parent"], d["start"], d["dur"], round(x_norm[i], precision), round(y_norm[i], precision)])
+        for i in range(rowCount):
+            writer.writerow([data["parent"][i], data["start"][i], data["dur"][i], round(x_norm[i], precision), round(y_norm[i], precision)])
     print("Wrote %s rows to %s" % (rowCount, OUTPUT_FILE))
 
 if PLOT:
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Streams a mix to the browser as it renders, so changes to a mix file can be heard right away
+# Usage:
+    # python -W ignore preview_mix.py -in ../data/output/bird_mix.txt -dir ../audio/downloads/birds/%s.mp3
+    # then, with server.js running, open http://localhost:2222/ui/preview_mix.html
+# Endpoints:
+    # /info returns the mix duration in ms as json
+    # /mix.wav?start=ms streams 16-bit wav from start (ms of the rendered mix)
+
+import argparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import json
+from multiprocessing.dummy import Pool as ThreadPool
+import numpy as np
+import os
+from SocketServer import ThreadingMixIn
+import socket
+import sys
+import urlparse
+from utils import applyReverbBlock, blockToPcm, compileMix, getAudioFrameRate, getMixClip, getMixDuration, getReverbDuration, getWavHeader, msToFrames, renderMixBlocks, selectMixWindow
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILE", default="../data/sample/mix.txt", help="Input txt file")
+parser.add_argument('-dir', dest="AUDIO_DIR", default="../audio/output/birds/%s.wav", help="Input audio directory")
+parser.add_argument('-left', dest="PAD_LEFT", default=3000, type=int, help="Pad left in milliseconds")
+parser.add_argument('-right', dest="PAD_RIGHT", default=3000, type=int, help="Pad right in milliseconds")
+parser.add_argument('-reverb', dest="REVERB", default=50, type=int, help="Add reverb (0-100)")
+parser.add_argument('-block', dest="BLOCK_DUR", default=500, type=int, help="Render block size in milliseconds; smaller blocks start playing sooner")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/mix/", help="Compiled mix plan cache dir, empty to disable")
+parser.add_argument('-workers', dest="WORKERS", default=-1, type=int, help="Number of threads loading clips, -1 for all cores")
+parser.add_argument('-host', dest="HOST", default="localhost", help="Host to listen on")
+parser.add_argument('-port', dest="PORT", default=2223, type=int, help="Port to listen on")
+args = parser.parse_args()
+
+INPUT_FILE = args.INPUT_FILE
+AUDIO_DIR = args.AUDIO_DIR
+PAD_LEFT = args.PAD_LEFT
+PAD_RIGHT = args.PAD_RIGHT
+REVERB = args.REVERB
+BLOCK_DUR = args.BLOCK_DUR
+CACHE_DIR = args.CACHE_DIR
+WORKERS = args.WORKERS
+HOST = args.HOST
+PORT = args.PORT
+
+MIN_VOLUME = 0.01
+MAX_VOLUME = 10.0
+CLIP_FADE_IN_DUR = 100
+CLIP_FADE_OUT_DUR = 100
+
+# clips are decoded by ffmpeg processes or read from memory-mapped wavs, so threads can load them in parallel
+pool = ThreadPool(WORKERS if WORKERS > 0 else None)
+
+def getPlan():
+    # recompiles only when the mix file changed, otherwise the plan comes from the cache
+    return compileMix(INPUT_FILE, AUDIO_DIR, padLeft=PAD_LEFT, minVolume=MIN_VOLUME, maxVolume=MAX_VOLUME, cacheDir=CACHE_DIR)
+
+def getFrameRate(plan):
+    # the first sound determines the frame rate of the mix
+    return getAudioFrameRate(plan["files"][plan["clipSound"][plan["clip"][0]]])
+
+def getPadRight(frameRate):
+    return PAD_RIGHT + getReverbDur(frameRate)
+
+def getReverbDur(frameRate):
+    # a sound keeps ringing for as long as the reverb's impulse response
+    return getReverbDuration(frameRate, REVERB) if REVERB > 0 else 0
+
+def streamMix(start=0):
+    # yields the wav header, then pcm as each block finishes rendering
+    plan = getPlan()
+    if len(plan["start"]) <= 0:
+        return
+    # taken from the whole mix, so every start renders at the same rate
+    frameRate = getFrameRate(plan)
+    preroll = getReverbDur(frameRate)
+    plan = selectMixWindow(plan, start, -1, preroll)
+    if len(plan["start"]) <= 0:
+        return
+
+    def getClips(clipIds):
+        return pool.map(lambda clipId: getMixClip(plan, clipId, frameRate, fadeIn=CLIP_FADE_IN_DUR, fadeOut=CLIP_FADE_OUT_DUR), clipIds)
+
+    def reverbBus(block, tail):
+        return applyReverbBlock(block, frameRate, tail, reverberance=REVERB)
+
+    effect = reverbBus if REVERB > 0 else None
+    yield getWavHeader(frameRate)
+    blocks = renderMixBlocks(plan, getClips, frameRate, blockFrames=msToFrames(BLOCK_DUR, frameRate), padRight=msToFrames(getPadRight(frameRate), frameRate), effect=effect, startFrame=msToFrames(max(start, 0), frameRate), preroll=msToFrames(preroll, frameRate), showProgress=False)
+    for block in blocks:
+        yield blockToPcm(block)
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    # chunked transfer encoding needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(url.query)
+        if url.path == "/info":
+            self.sendInfo()
+        elif url.path == "/mix.wav":
+            try:
+                start = int(float(query.get("start", ["0"])[0]))
+            except (ValueError, OverflowError):
+                self.send_error(400, "start must be a number of ms")
+                return
+            self.sendMix(max(start, 0))
+        else:
+            self.send_error(404)
+
+    def sendHeaders(self, contentType, length=None):
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        # the ui is served by server.js on another port
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-cache")
+        if length is None:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def sendInfo(self):
+        plan = getPlan()
+        padRight = getPadRight(getFrameRate(plan)) if len(plan["start"]) > 0 else PAD_RIGHT
+        data = json.dumps({
+            "mix": INPUT_FILE,
+            "duration": getMixDuration(plan, padRight),
+            "events": len(plan["start"])
+        })
+        self.sendHeaders("application/json", len(data))
+        self.wfile.write(data)
+
+    def sendMix(self, start):
+        self.sendHeaders("audio/wav")
+        try:
+            for data in streamMix(start):
+                self.wfile.write("%X\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write("0\r\n\r\n")
+        except (socket.error, IOError):
+            # the browser seeked or closed the page; closing the generator stops rendering
+            pass
+
+class PreviewServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+server = PreviewServer((HOST, PORT), PreviewHandler)
+print("Previewing %s on http://%s:%s" % (INPUT_FILE, HOST, PORT))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+server.server_close()
+pool.close()
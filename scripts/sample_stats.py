@@ -7,11 +7,11 @@ import os
 import numpy as np
 from pprint import pprint
 import sys
-from utils import readCsv
+from utils import loadColumns
 
 # input
 parser = argparse.ArgumentParser()
-parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audio_samples.csv", help="Input csv file")
+parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audio_samples.csv", help="Input csv file or column store")
 parser.add_argument('-out', dest="OUTPUT_FILE", default="../data/output/birds_audio_sample_stats_%s.csv", help="Output csv file")
 parser.add_argument('-plot', dest="PLOT", default=0, type=int, help="Whether to show plot")
 args = parser.parse_args()
@@ -21,37 +21,37 @@ OUTPUT_FILE = args.OUTPUT_FILE
 PLOT = args.PLOT > 0
 
 print("Reading data file...")
-data = readCsv(INPUT_FILE)
-rowCount = len(data)
+data = loadColumns(INPUT_FILE, ["note", "octave", "power", "hz"], schema="samples")
+rowCount = len(data["note"])
 print("Found %s rows in %s" % (rowCount, INPUT_FILE))
 
 # keys: parent,start,dur,power,hz,note,octave
 
-notes = []
-octaves = []
-noteOctaves = []
-x = []
-y = []
-for entry in data:
-    notes.append(entry["note"])
-    octaves.append(entry["octave"])
-    noteOctaves.append(entry["note"]+str(entry["octave"]))
-    x.append(entry["power"])
-    y.append(entry["hz"])
+def mostCommon(values):
+    # like collections.Counter.most_common(): by count, then by first occurrence
+    unique, first, counts = np.unique(values, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    return list(zip(unique[order].tolist(), counts[order].tolist()))
+
+notes = data["note"].astype(str)
+octaves = data["octave"]
+noteOctaves = np.char.add(notes, octaves.astype(str))
+x = data["power"]
+y = data["hz"]
 
 print("NOTES:")
-noteCounter = collections.Counter(notes)
-pprint(noteCounter.most_common())
+noteCounts = mostCommon(notes)
+pprint(noteCounts)
 print "====="
 
 print("OCTAVES:")
-octaveCounter = collections.Counter(octaves)
-pprint(octaveCounter.most_common())
+octaveCounts = mostCommon(octaves)
+pprint(octaveCounts)
 print "====="
 
 print("NOTES WITH OCTAVES:")
-noteOctaveCounter = collections.Counter(noteOctaves)
-pprint(noteOctaveCounter.most_common(20))
+noteOctaveCounts = mostCommon(noteOctaves)
+pprint(noteOctaveCounts[:20])
 print "====="
 
 # show scatter plot of data
@@ -71,7 +71,7 @@ def writeCsv(filename, data, headings):
         print "Wrote %s rows to %s" % (len(rows), filename)
 
 headings = ["Value", "Frequency"]
-writeCsv(OUTPUT_FILE % "notes", noteCounter.most_common(), headings)
-writeCsv(OUTPUT_FILE % "octaves", octaveCounter.most_common(), headings)
+writeCsv(OUTPUT_FILE % "notes", noteCounts, headings)
+writeCsv(OUTPUT_FILE % "octaves", octaveCounts, headings)
 headings = ["Note", "Octave", "Frequency"]
-writeCsv(OUTPUT_FILE % "note_octaves", [(noteoctave[:-1], int(noteoctave[-1:]), freq) for noteoctave, freq in noteOctaveCounter.most_common()], headings)
+writeCsv(OUTPUT_FILE % "note_octaves", [(noteoctave[:-1], int(noteoctave[-1:]), freq) for noteoctave, freq in noteOctaveCounts], headings)
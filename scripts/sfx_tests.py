@@ -1,12 +1,11 @@
 # -*- coding: utf-8 -*-
 
-# Wrapper for SOX: http://sox.sourceforge.net/sox.html#EFFECTS
+# Reverb parameters follow SOX: http://sox.sourceforge.net/sox.html#EFFECTS
 
-import array
 import librosa
 import numpy as np
 from pydub import AudioSegment
-from pysndfx import AudioEffectsChain
+from utils import applyReverb, arrayToSegment, makeMixBuffer, mixClip, msToFrames, segmentToArray
 
 infile = '../audio/downloads/birds/Boreal Owl 1 AK Male primary or staccato song.mp3'
 clipStart = 9596
@@ -30,42 +29,28 @@ clip = sound[clipStart:clipEnd]
 clip = clip.fade_out(fadeDur)
 
 # Add padding to clip and get the sample data as np array
-padding = AudioSegment.silent(duration=clipPadding)
+padding = AudioSegment.silent(duration=clipPadding, frame_rate=frame_rate)
 clip = clip + padding
-# samples = np.right_shift(clip.get_array_of_samples(), 1)
-samples = np.array(clip.get_array_of_samples())
-samples = samples.astype(np.int16)
+samples = segmentToArray(clip)
 
 # build a base audio file
 totalDuration = (clipDur + clipPadding) * len(reverbTests) * 2
 print("Creating audio file %s seconds long" % round(totalDuration/1000, 2))
-baseAudio = AudioSegment.silent(duration=totalDuration, frame_rate=frame_rate)
+baseAudio = makeMixBuffer(msToFrames(totalDuration, frame_rate), samples.shape[1])
+
+# apply each reverb test to the sample data
+reverbClips = [applyReverb(samples, frame_rate, reverberance=reverberance, hf_damping=hf_damping, room_scale=room_scale) for reverberance, hf_damping, room_scale in reverbTests]
 
 # go through each reverb test and add to base audio
 pos = 0
-for test in reverbTests:
+for newClip in reverbClips:
     # Add the original audio clip
-    baseAudio = baseAudio.overlay(clip, pos)
+    mixClip(baseAudio, samples, msToFrames(pos, frame_rate))
     pos += clipDur + clipPadding
 
-    # build reverb effect
-    reverberance, hf_damping, room_scale = test
-    fx = (
-        AudioEffectsChain()
-        .reverb(reverberance=reverberance, hf_damping=hf_damping, room_scale=room_scale)
-    )
-    # apply effect to np array of samples
-    y = np.copy(samples)
-    y = fx(y)
-    # y /= np.abs(y).max()
-
-    # convert it back to an array and create a new sound clip
-    newData = array.array(clip.array_type, y)
-    newClip = clip._spawn(newData)
-
     # add new clip to audio
-    baseAudio = baseAudio.overlay(newClip, pos)
+    mixClip(baseAudio, newClip, msToFrames(pos, frame_rate))
     pos += clipDur + clipPadding
 
-baseAudio.export(outfile, format="mp3")
+arrayToSegment(baseAudio, frame_rate, clip.sample_width).export(outfile, format="mp3")
 print("Wrote result to %s" % outfile)
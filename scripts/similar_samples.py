@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Finds the samples that sound most like given samples, using the feature vectors stored by audio_to_tsne.py
+# Usage:
+    # python audio_to_tsne.py -W ignore -in "../audio/downloads/birds/*.mp3" -samples -1
+    # python similar_samples.py -query "XC123456:2300" -k 10
+    # python similar_samples.py -in ../data/output/birds_audio_samples.csv -k 5 -out ../data/output/birds_similar.json
+    # python similar_samples.py -build 1 -tree 1
+
+import argparse
+import json
+import numpy as np
+import os
+from pprint import pprint
+import sys
+import time
+from utils import FEATURE_COLUMNS, buildKnnIndex, getSampleIndices, queryKnnIndex, readCsv, readKnnIndex
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-features', dest="FEATURE_DIR", default="../data/output/birds_audio_tsne_features", help="Feature vector store written by audio_to_tsne.py")
+parser.add_argument('-query', dest="QUERY", default="", help="Comma-separated samples to query as parent:start (start in ms)")
+parser.add_argument('-in', dest="INPUT_FILE", default="", help="CSV file with parent and start columns to query in one batch, e.g. a samples file")
+parser.add_argument('-k', dest="K", default=10, type=int, help="Number of similar samples per query")
+parser.add_argument('-build', dest="BUILD", default=0, type=int, help="Rebuild the index?")
+parser.add_argument('-tree', dest="TREE", default=0, type=int, help="Build a ball tree instead of searching by brute force (with -build 1)")
+parser.add_argument('-out', dest="OUTPUT_FILE", default="", help="JSON output file, empty to print")
+args = parser.parse_args()
+
+# Parse arguments
+FEATURE_DIR = args.FEATURE_DIR
+QUERY = args.QUERY
+INPUT_FILE = args.INPUT_FILE
+K = args.K
+BUILD = args.BUILD > 0
+TREE = args.TREE > 0
+OUTPUT_FILE = args.OUTPUT_FILE
+
+if BUILD:
+    buildKnnIndex(FEATURE_DIR, tree=TREE)
+
+t0 = time.time()
+index = readKnnIndex(FEATURE_DIR)
+data = index["data"]
+print("Loaded %s samples from %s in %sms" % (len(index["vectors"]), FEATURE_DIR, int(round((time.time() - t0) * 1000))))
+
+# queries are samples that are in the store
+queries = []
+if len(QUERY) > 0:
+    for q in QUERY.split(","):
+        parent, start = tuple(q.strip().rsplit(":", 1))
+        queries.append((parent, int(start)))
+if len(INPUT_FILE) > 0:
+    queries += [(row["parent"], int(row["start"])) for row in readCsv(INPUT_FILE, doParseNumbers=False)]
+
+if len(queries) <= 0:
+    if not BUILD:
+        print("No queries; use -query or -in")
+    sys.exit(0 if BUILD else 1)
+
+sampleIndices = getSampleIndices(data)
+found = [q for q in queries if q in sampleIndices]
+if len(found) < len(queries):
+    print("%s queries are not in the store" % (len(queries) - len(found)))
+if len(found) <= 0:
+    sys.exit(1)
+rows = np.array([sampleIndices[q] for q in found])
+
+# one batch for all queries; ask for one extra so each query can leave itself out
+t0 = time.time()
+indices, distances = queryKnnIndex(index, index["vectors"][rows], k=K+1)
+ms = (time.time() - t0) * 1000
+print("Queried %s samples in %sms" % (len(rows), round(ms, 2)))
+
+def getSample(i):
+    return dict([(key, data[key][i].item() if hasattr(data[key][i], "item") else data[key][i]) for key in FEATURE_COLUMNS])
+
+results = []
+for row, neighbors, neighborDistances in zip(rows, indices, distances):
+    similar = []
+    for i, distance in zip(neighbors, neighborDistances):
+        if i == row:
+            continue
+        sample = getSample(i)
+        sample["distance"] = round(float(distance), 5)
+        similar.append(sample)
+    results.append({"query": getSample(row), "similar": similar[:K]})
+
+output = {"k": K, "ms": round(ms, 2), "results": results}
+if len(OUTPUT_FILE) > 0:
+    with open(OUTPUT_FILE, 'w') as f:
+        json.dump(output, f, indent=1)
+    print("Wrote %s results to %s" % (len(results), OUTPUT_FILE))
+else:
+    print(json.dumps(output, indent=1))
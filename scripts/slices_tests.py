@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Checks that getSlices returns the same slices as the original per-element loop
+# Usage:
+    # python slices_tests.py
+    # python slices_tests.py -in "../audio/downloads/birds/*.mp3" -synth 10000
+
+import argparse
+import glob
+import librosa
+import numpy as np
+import os
+import sys
+from utils import getSlices, loadAudio
+
+# input
+parser = argparse.ArgumentParser()
+parser.add_argument('-in', dest="INPUT_FILES", default="../audio/sample/*.mp3", help="Input file pattern for recorded envelopes")
+parser.add_argument('-synth', dest="SYNTH_COUNT", default=1000, type=int, help="Number of synthetic envelopes to test")
+parser.add_argument('-seed', dest="SEED", default=1, type=int, help="Seed for synthetic envelopes")
+parser.add_argument('-cache', dest="CACHE_DIR", default="../data/cache/audio/", help="Decoded audio cache dir, empty to disable")
+args = parser.parse_args()
+
+INPUT_FILES = args.INPUT_FILES
+SYNTH_COUNT = args.SYNTH_COUNT
+SEED = args.SEED
+CACHE_DIR = args.CACHE_DIR
+
+# Audio config
+FFT = 2048
+HOP_LEN = FFT/4
+
+# Slice settings: default/fixed thresholds and a range of length limits
+SETTINGS = [
+    (-1, 4, 43),
+    (-1, 1, 1000),
+    (0.0, 0, 1000),
+    (0.25, 2, 20),
+    (0.5, 0, 5)
+]
+
+# the original implementation, kept as the reference
+def getSlicesLoop(e, ampMin, minLen, maxLen):
+    stdev = np.std(e)
+    minAmp = min(stdev * 1.5, 0.5)
+    if ampMin >= 0:
+        minAmp = ampMin
+    slices = []
+    prev = None
+    start = None
+    end = None
+    for i, value in enumerate(e):
+        # first
+        if prev is None:
+            prev = value
+            continue
+        # we've hit the beginning of a slice
+        if prev < minAmp and value >= minAmp:
+            start = i
+        # we've hit the end of a slice
+        elif prev >= minAmp and value < minAmp:
+            end = i
+        # add slice
+        if start is not None and end is not None:
+            if end > start:
+                slices.append([start, end])
+            start = None
+            end = None
+        prev = value
+
+    maxIndex = len(e) - 1
+    # backtrack and look ahead
+    for i, slice in enumerate(slices):
+        left, right = tuple(slice)
+        # backtrack left
+        value = e[left]
+        j = left - 1
+        while j >= 0:
+            vnew = e[j]
+            if vnew < value:
+                value = vnew
+            else:
+                break
+            j -= 1
+        leftNew = max(j + 1, 0)
+        # look ahead right
+        value = e[right]
+        j = right + 1
+        while j <= maxIndex:
+            vnew = e[j]
+            if vnew < value:
+                value = vnew
+            else:
+                break
+            j += 1
+        rightNew = min(j - 1, maxIndex)
+        # update slice
+        slices[i] = [leftNew, rightNew]
+
+    # remove slices that are too long or too short
+    slices = [s for s in slices if s[1]-s[0] >= minLen and s[1]-s[0] <= maxLen]
+
+    return slices
+
+def getRecordedEnvelope(fn):
+    y, sr = loadAudio(fn, cacheDir=CACHE_DIR)
+    y = y / y.max()
+    e = librosa.feature.rmse(S=np.abs(librosa.stft(y, n_fft=FFT, hop_length=HOP_LEN)))[0]
+    e -= e.min()
+    e /= e.max()
+    return e
+
+def getSynthEnvelope(rand, i):
+    n = rand.randint(0, 500)
+    kind = i % 4
+    # uniform noise
+    if kind == 0:
+        e = rand.rand(n)
+    # few distinct levels, so plateaus and ties are common
+    elif kind == 1:
+        e = rand.randint(0, 4, n) / 3.0
+    # random walk
+    elif kind == 2:
+        e = np.abs(np.cumsum(rand.randn(n)))
+    # bursts over a noise floor, sometimes starting above the threshold
+    else:
+        e = rand.rand(n) * 0.1
+        for j in range(rand.randint(0, 10)):
+            left = rand.randint(0, max(n, 1))
+            e[left:left+rand.randint(1, 30)] += rand.rand()
+    if n > 0 and e.max() > 0:
+        e = e / e.max()
+    return e
+
+def compare(label, e):
+    failures = 0
+    for ampMin, minLen, maxLen in SETTINGS:
+        expected = getSlicesLoop(e, ampMin, minLen, maxLen)
+        result = getSlices(e, ampMin, minLen, maxLen)
+        if result != expected:
+            print("Mismatch in %s (amp=%s, min=%s, max=%s): expected %s slices, got %s" % (label, ampMin, minLen, maxLen, len(expected), len(result)))
+            failures += 1
+    return failures
+
+failures = 0
+tests = 0
+
+files = glob.glob(INPUT_FILES)
+print("Testing %s recorded envelopes..." % len(files))
+for fn in files:
+    failures += compare(os.path.basename(fn), getRecordedEnvelope(fn))
+    tests += len(SETTINGS)
+
+print("Testing %s synthetic envelopes..." % SYNTH_COUNT)
+rand = np.random.RandomState(SEED)
+for i in range(SYNTH_COUNT):
+    failures += compare("synthetic envelope %s" % i, getSynthEnvelope(rand, i))
+    tests += len(SETTINGS)
+
+print("%s of %s tests failed" % (failures, tests))
+if failures > 0:
+    sys.exit(1)
@@ -2,16 +2,17 @@
 
 import argparse
 import csv
+import numpy as np
 import os
 from PIL import Image, ImageDraw
 from pprint import pprint
 import random
 import sys
-from utils import readCsv
+from utils import loadColumns
 
 # input
 parser = argparse.ArgumentParser()
-parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audio_tsne.csv", help="Input csv file")
+parser.add_argument('-in', dest="INPUT_FILE", default="../data/output/birds_audio_tsne.csv", help="Input csv file or column store")
 parser.add_argument('-width', dest="WIDTH", default=8000, type=int, help="Target width")
 parser.add_argument('-height', dest="HEIGHT", default=8000, type=int, help="Target height")
 parser.add_argument('-rad', dest="RADIUS", default=4, type=int, help="Radius of each audio clip")
@@ -45,11 +46,13 @@ colorCount = len(colors)
 
 # Read files
 print("Reading data file...")
-data = readCsv(INPUT_FILE)
-rowCount = len(data)
+data = loadColumns(INPUT_FILE, ["group", "x", "y"], schema="tsne")
+rowCount = len(data["x"])
 print("Found %s rows in %s" % (rowCount, INPUT_FILE))
 
-groups = list(set(d["group"] for d in data))
+groups, groupIndices = np.unique(data["group"].astype(str), return_inverse=True)
+xs = data["x"] * WIDTH
+ys = data["y"] * HEIGHT
 
 # Make sure output dirs exist
 outDirs = [os.path.dirname(OUTPUT_FILE)]
@@ -60,12 +63,12 @@ for outDir in outDirs:
 im = Image.new(mode="RGB", size=(WIDTH, HEIGHT), color=(0, 0, 0))
 
 draw = ImageDraw.Draw(im)
-for i, d in enumerate(data):
-    x0 = d["x"] * WIDTH
-    y0 = d["y"] * HEIGHT
+for i in range(rowCount):
+    x0 = xs[i]
+    y0 = ys[i]
     x1 = x0 + RADIUS * 2
     y1 = y0 + RADIUS * 2
-    color = colors[groups.index(d["group"]) % colorCount]
+    color = colors[groupIndices[i] % colorCount]
     draw.ellipse([x0, y0, x1, y1], fill=color)
     sys.stdout.write('\r')
     sys.stdout.write("%s%%" % round(1.0*(i+1)/rowCount*100,1))
@@ -1,3 +1,11 @@
 from audio_utils import *
+from cache_utils import *
+from embed_utils import *
+from feature_utils import *
 from io_utils import *
+from knn_utils import *
+from manifest_utils import *
 from math_utils import *
+from mix_utils import *
+from phrase_utils import *
+from pool_utils import *
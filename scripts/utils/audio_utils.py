@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-import array
+from cache_utils import AUDIO_CACHE_DIR, getAudioCacheFilename, loadAudio
 import librosa
 from librosa import display
 import math
@@ -11,35 +11,175 @@ import numpy as np
 import os
 from pprint import pprint
 from pydub import AudioSegment
-from pysndfx import AudioEffectsChain
 import re
+from scipy import fftpack
+from scipy import signal
+from scipy.io import wavfile
+import subprocess
 import sys
 
-def addReverb(sound, reverberance=50):
-    # convert pydub sound to np array
-    samples = np.array(sound.get_array_of_samples())
-    samples = samples.astype(np.int16)
+# Freeverb delay lengths at 44.1kHz
+REVERB_COMB_LENGTHS = [1116, 1188, 1277, 1356, 1422, 1491, 1557, 1617]
+REVERB_ALLPASS_LENGTHS = [556, 441, 341, 225]
+REVERB_STEREO_SPREAD = 23
+REVERB_INPUT_GAIN = 0.015
+REVERB_IMPULSES = {}
 
-    # apply reverb effect
-    fx = (
-        AudioEffectsChain()
-        .reverb(reverberance=reverberance)
-    )
-    y = fx(samples)
+def addReverb(sound, reverberance=50, hf_damping=50, room_scale=100):
+    # convert pydub sound to a frames x channels array, add reverb and convert back
+    y = segmentToArray(sound)
+    y = applyReverb(y, sound.frame_rate, reverberance=reverberance, hf_damping=hf_damping, room_scale=room_scale)
+    return arrayToSegment(y, sound.frame_rate, sound.sample_width)
 
-    # convert it back to an array and create a new sound clip
-    newData = array.array(sound.array_type, y)
-    newSound = sound._spawn(newData)
-    return newSound
+def allpassFilter(x, delay, feedback=0.5):
+    # Freeverb allpass: v[n] = x[n] + g*v[n-d], y[n] = v[n-d] - x[n]; one row of d samples at a time
+    n = len(x)
+    rows = np.zeros((int(math.ceil(1.0 * n / delay)), delay))
+    rows.flat[:n] = x
+    v = np.zeros_like(rows)
+    prev = np.zeros(delay)
+    for k in range(len(rows)):
+        v[k] = rows[k] + feedback * prev
+        prev = v[k]
+    return np.concatenate((np.zeros(delay), v.ravel()))[:n] - x
 
-def getAudioSamples(fn, min_dur=0.05, max_dur=0.75, fft=2048, hop_length=512, amp_threshold=-1, plot=False, plotfilename="../data/output/plot.png", groupName=""):
+def applyReverb(y, sr, reverberance=50, hf_damping=50, room_scale=100, stereo_depth=100, wet_gain=0):
+    # y is a frames x channels array, or a list of them to process as one batch;
+    # output has the same length as the input, so pad clips to make room for the tail
+    isBatch = isinstance(y, list)
+    clips = y if isBatch else [y]
+    if len(clips) <= 0:
+        return clips
+    impulse = getReverbImpulse(sr, reverberance, hf_damping, room_scale, stereo_depth)
+    channels = clips[0].shape[1]
+    frames = max([len(clip) for clip in clips])
+    batch = np.zeros((len(clips), frames, channels), dtype=np.float32)
+    for i, clip in enumerate(clips):
+        batch[i, :len(clip)] = clip
+    # mono uses the left channel's response
+    impulse = impulse[:, :channels] if channels <= impulse.shape[1] else np.repeat(impulse[:, :1], channels, axis=1)
+    wet = signal.fftconvolve(batch, impulse[np.newaxis], axes=1)[:, :frames]
+    wet *= 10.0 ** (wet_gain / 20.0)
+    results = [(clip + wet[i, :len(clip)]).astype(clip.dtype) for i, clip in enumerate(clips)]
+    return results if isBatch else results[0]
+
+def applyReverbBlock(y, sr, tail=None, reverberance=50, hf_damping=50, room_scale=100, stereo_depth=100, wet_gain=0):
+    # wet signal only, for a stream of blocks: the tail that rings past this block is returned
+    # and added to the next one (overlap-add)
+    impulse = getReverbImpulse(sr, reverberance, hf_damping, room_scale, stereo_depth)
+    channels = y.shape[1]
+    impulse = impulse[:, :channels] if channels <= impulse.shape[1] else np.repeat(impulse[:, :1], channels, axis=1)
+    wet = signal.fftconvolve(y, impulse, axes=0) * (10.0 ** (wet_gain / 20.0))
+    if tail is not None:
+        if len(tail) > len(wet):
+            wet = np.concatenate((wet, np.zeros((len(tail) - len(wet), channels))))
+        wet[:len(tail)] += tail
+    frames = len(y)
+    return (wet[:frames].astype(y.dtype), wet[frames:])
+
+def arrayToSegment(y, frameRate, sampleWidth=2):
+    # float frames x channels array in -1..1 to a pydub sound, clipped to the integer range
+    maxValue = 2 ** (sampleWidth * 8 - 1)
+    samples = np.clip(np.round(y * maxValue), -maxValue, maxValue - 1).astype("<i%s" % sampleWidth)
+    return AudioSegment(data=samples.tobytes(), sample_width=sampleWidth, frame_rate=frameRate, channels=y.shape[1])
+
+def combFilter(x, delay, feedback, damp):
+    # Freeverb comb with a one-pole lowpass in the feedback loop:
+    # s[n] = (1-damp)*w[n-d] + damp*s[n-1], w[n] = x[n] + feedback*s[n], y[n] = w[n-d]
+    n = len(x)
+    rows = np.zeros((int(math.ceil(1.0 * n / delay)), delay))
+    rows.flat[:n] = x
+    w = np.zeros_like(rows)
+    prev = np.zeros(delay)
+    zi = np.zeros(1)
+    for k in range(len(rows)):
+        s, zi = signal.lfilter([1.0 - damp], [1.0, -damp], prev, zi=zi)
+        w[k] = rows[k] + feedback * s
+        prev = w[k]
+    return np.concatenate((np.zeros(delay), w.ravel()))[:n]
+
+def getAudioBlocks(fn, sr=22050, blockSize=2**20, cacheDir=AUDIO_CACHE_DIR):
+    # read from the decoded audio cache if this file is in it
+    if cacheDir:
+        cacheFn = getAudioCacheFilename(fn, sr, np.float32, cacheDir)
+        if os.path.isfile(cacheFn):
+            y = np.load(cacheFn, mmap_mode="r")
+            for i in range(0, len(y), blockSize):
+                yield np.array(y[i:i+blockSize])
+            return
+
+    # otherwise decode to mono float32 at the target sample rate with ffmpeg
+    command = ["ffmpeg", "-v", "error", "-i", fn, "-f", "f32le", "-ac", "1", "-ar", str(sr), "-"]
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE)
+    blockBytes = blockSize * 4
+    try:
+        while True:
+            data = proc.stdout.read(blockBytes)
+            data = data[:len(data)//4*4]
+            if len(data) <= 0:
+                break
+            yield np.frombuffer(data, dtype=np.float32)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+def getAudioEnvelope(fn, sr=22050, fft=2048, hop_length=512, blockSize=2**20, cacheDir=AUDIO_CACHE_DIR):
+    # frames are centered like librosa.stft, with zeros instead of reflection at the edges
+    pad = fft // 2
+    carry = np.zeros(pad, dtype=np.float32)
+    rmses = []
+    rolloffs = []
+    ymax = None
+    ylen = 0
+
+    def addFrames(buf):
+        S = np.abs(librosa.stft(buf, n_fft=fft, hop_length=hop_length, center=False))
+        rmses.append(librosa.feature.rmse(S=S)[0])
+        rolloffs.append(librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=fft, hop_length=hop_length)[0])
+        # keep the samples the next frame starts on
+        return buf[S.shape[1]*hop_length:]
+
+    for block in getAudioBlocks(fn, sr=sr, blockSize=blockSize, cacheDir=cacheDir):
+        ylen += len(block)
+        blockMax = block.max()
+        ymax = blockMax if ymax is None else max(ymax, blockMax)
+        buf = np.concatenate((carry, block))
+        carry = addFrames(buf) if len(buf) >= fft else buf
+
+    if ylen <= 0:
+        return ([], [], None, 0, sr)
+
+    # flush the last frames
+    buf = np.concatenate((carry, np.zeros(pad, dtype=np.float32)))
+    if len(buf) >= fft:
+        addFrames(buf)
+
+    return (np.concatenate(rmses), np.concatenate(rolloffs), ymax, ylen, sr)
+
+def getAudioFrameRate(fn):
+    rate, channels = getAudioInfo(fn)
+    return rate
+
+def getAudioInfo(fn):
+    # (frame rate, channels); wav headers can be read directly, anything else asks ffprobe
+    if fn.lower().endswith(".wav"):
+        try:
+            rate, data = wavfile.read(fn, mmap=True)
+            return (rate, 1 if data.ndim < 2 else data.shape[1])
+        except (ValueError, TypeError, NotImplementedError):
+            pass
+    command = ["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=sample_rate,channels", "-of", "default=noprint_wrappers=1", fn]
+    info = dict([line.split("=", 1) for line in subprocess.check_output(command).decode("utf-8").split() if "=" in line])
+    return (int(info["sample_rate"]), int(info["channels"]))
+
+def getAudioSamples(fn, min_dur=0.05, max_dur=0.75, fft=2048, hop_length=512, amp_threshold=-1, plot=False, plotfilename="../data/output/plot.png", groupName="", cacheDir=AUDIO_CACHE_DIR, features=False):
     basename = os.path.splitext(os.path.basename(fn))[0]
     y = []
     sr = None
 
     # load audio
     try:
-        y, sr = librosa.load(fn)
+        y, sr = loadAudio(fn, cacheDir=cacheDir)
     except Exception as e:
         print("Error loading %s" % fn)
 
@@ -47,70 +187,85 @@ def getAudioSamples(fn, min_dur=0.05, max_dur=0.75, fft=2048, hop_length=512, am
     if len(y) < 2:
         return ([], [], [], None)
 
-    y /= y.max()
+    # cached audio is memory-mapped read-only, so normalize into a new array
+    y = y / y.max()
     ylen = len(y)
-    duration = ylen/sr
 
     min_duration_frames = librosa.core.time_to_frames([min_dur], sr=sr, hop_length=hop_length)[0]
     max_duration_frames = librosa.core.time_to_frames([max_dur], sr=sr, hop_length=hop_length)[0]
 
-    # compute the rmse (root-mean-square energy) and threshold at a fixed value
-    S = librosa.stft(y, n_fft=fft, hop_length=hop_length)
-    e = librosa.feature.rmse(S=S)[0]
-    e -= e.min()
+    # compute the spectrogram once; per-sample features are read from its frames
+    S = np.abs(librosa.stft(y, n_fft=fft, hop_length=hop_length))
+    rmse = librosa.feature.rmse(S=S)[0]
+    rolloffs = librosa.feature.spectral_rolloff(S=S, sr=sr, n_fft=fft, hop_length=hop_length)[0]
+
+    # normalize the rmse (root-mean-square energy) and threshold at a fixed value
+    e = rmse - rmse.min()
     e /= e.max()
 
     slices = getSlices(e, amp_threshold, min_duration_frames, max_duration_frames)
     sliceCount = len(slices)
     # print("Found %s samples in %s" % (sliceCount, basename))
-    sampleData = []
-    ysamples = []
-    i = 0
-    for left, right in slices:
-        ysample = y[left*hop_length:right*hop_length]
-        stft = librosa.feature.rmse(S=librosa.stft(ysample, n_fft=fft, hop_length=hop_length))[0]
-        rolloff = librosa.feature.spectral_rolloff(y=ysample, sr=sr)[0]
-        # notes = [librosa.hz_to_note(hz) for hz in rolloff]
-        # pprint(notes)
-        start = round(1.0 * (left*hop_length) / ylen, 5)
-        end =  round(1.0 * (right*hop_length) / ylen, 5)
-        dur = int(round((end - start) * duration * 1000))
-        power = round(weighted_mean(stft), 2)
-        hz = round(weighted_mean(rolloff), 2)
-        note = librosa.hz_to_note(hz)
-        startms = int(round(start * duration * 1000))
-        sampleFilename = "%s %s.wav" % (basename, startms)
-
-        # parse note
-        octave = -1
-        matches = re.match("([A-Z]\#?b?)(\-?[0-9]+)", note)
-        if matches:
-            note = matches.group(1)
-            octave = int(matches.group(2))
+    sampleData = getSampleData(slices, rmse, rolloffs, ylen, sr, hop_length, basename, groupName)
+    ysamples = [y[left*hop_length:right*hop_length] for left, right in slices]
 
-        ysamples.append(ysample)
-        sampleData.append({
-            "index": i,
-            "parent": basename,
-            "group": groupName,
-            "filename": sampleFilename,
-            "start": startms,
-            "dur": dur,
-            "power": power,
-            "hz": hz,
-            "note": note,
-            "octave": octave,
-            "left": left,
-            "right": right
-        })
-        i+=1
-        # print("pos=%s, dur=%s, hz=%s (%s) power=%s" % (start, dur, hz, note, power))
+    # t-SNE feature vectors for every sample, read from the same spectrogram
+    if features and sliceCount > 0:
+        featureVectors = getFeatureVectors(S, sr, slices)
+        for d in sampleData:
+            d["featureVector"] = featureVectors[d["index"]]
 
     if plot:
         showAudioPlot(y, e, slices, filename=plotfilename)
 
     return (sampleData, ysamples, y, sr)
 
+# snatched from: https://github.com/ml4a/ml4a-guides/blob/master/notebooks/audio-tsne.ipynb
+def getFeatureVector(y, sr):
+    S = librosa.feature.melspectrogram(y, sr=sr, n_mels=128)
+    log_S = librosa.amplitude_to_db(S, ref=np.max)
+    mfcc = librosa.feature.mfcc(S=log_S, n_mfcc=13)
+    delta_mfcc = librosa.feature.delta(mfcc, mode='nearest')
+    delta2_mfcc = librosa.feature.delta(mfcc, order=2, mode='nearest')
+    feature_vector = np.concatenate((np.mean(mfcc,1), np.mean(delta_mfcc,1), np.mean(delta2_mfcc,1)))
+    feature_vector = (feature_vector-np.mean(feature_vector))/np.std(feature_vector)
+    return feature_vector
+
+def getFeatureVectors(S, sr, slices, n_mels=128, n_mfcc=13, width=9, top_db=80.0, amin=1e-5):
+    # the same features as getFeatureVector(), for all slices at once from a whole-file magnitude spectrogram;
+    # slice [left, right) covers frames left..right inclusive, the frames an stft of y[left*hop:right*hop] would have,
+    # like the power and rolloff in getSampleData()
+    frameCount = S.shape[1]
+    slices = np.array(slices, dtype=np.int64).reshape(-1, 2)
+    lefts = np.minimum(slices[:,0], frameCount-1)
+    rights = np.minimum(slices[:,1], frameCount-1)
+    counts = rights - lefts + 1
+    # pad each slice with copies of its edge frames, so the delta filter never reads a neighbouring slice
+    pad = width // 2
+    padCounts = counts + 2 * pad
+    padOffsets = np.concatenate(([0], np.cumsum(padCounts)))
+    positions = np.arange(padOffsets[-1]) - np.repeat(padOffsets[:-1], padCounts) - pad
+    frames = np.clip(np.repeat(lefts, padCounts) + positions, np.repeat(lefts, padCounts), np.repeat(rights, padCounts))
+
+    # only the frames inside slices go through the mel filters
+    melBasis = librosa.filters.mel(sr=sr, n_fft=2*(S.shape[0]-1), n_mels=n_mels)
+    mel = melBasis.dot(S[:, frames]**2)
+
+    # decibels relative to each slice's max, like amplitude_to_db(ref=np.max) on each sample
+    logMel = 20.0 * np.log10(np.maximum(amin, mel))
+    refs = np.maximum.reduceat(logMel.max(axis=0), padOffsets[:-1])
+    logMel = np.maximum(logMel - np.repeat(refs, padCounts), -top_db)
+
+    mfcc = fftpack.dct(logMel, axis=0, type=2, norm='ortho')[:n_mfcc]
+    deltas = [signal.savgol_filter(mfcc, width, deriv=order, polyorder=order, axis=-1, mode='nearest') for order in (1, 2)]
+
+    # mean over each slice's own frames, dropping the padding
+    inside = (positions >= 0) & (positions < np.repeat(counts, padCounts))
+    offsets = np.concatenate(([0], np.cumsum(counts)))[:-1]
+    means = [np.add.reduceat(m[:, inside], offsets, axis=1) / counts for m in [mfcc] + deltas]
+    vectors = np.concatenate(means, axis=0).T
+    return (vectors - vectors.mean(axis=1, keepdims=True)) / vectors.std(axis=1, keepdims=True)
+
 def getPhrases(sampleData, minLen, maxLen, maxSilence, minNotesPerPhrase=2):
     # conver to ms
     minLen *= 1000
@@ -148,68 +303,178 @@ def getPhrases(sampleData, minLen, maxLen, maxSilence, minNotesPerPhrase=2):
 
     return phrases
 
+def getReverbDuration(sr, reverberance=50, hf_damping=50, room_scale=100, stereo_depth=100, maxDur=10.0):
+    # how long in ms a sound keeps ringing after it ends
+    impulse = getReverbImpulse(sr, reverberance, hf_damping, room_scale, stereo_depth, maxDur)
+    return int(math.ceil(1000.0 * len(impulse) / sr))
+
+def getReverbImpulse(sr, reverberance=50, hf_damping=50, room_scale=100, stereo_depth=100, maxDur=10.0):
+    key = (sr, reverberance, hf_damping, room_scale, stereo_depth, maxDur)
+    if key in REVERB_IMPULSES:
+        return REVERB_IMPULSES[key]
+
+    # map the controls the same way SoX's reverb effect does
+    a = -1.0 / math.log(1.0 - 0.3)
+    b = 100.0 / (math.log(1.0 - 0.98) * a + 1.0)
+    feedback = 1.0 - math.exp((reverberance - b) / (a * b))
+    damp = hf_damping / 100.0 * 0.3 + 0.2
+    scale = room_scale / 100.0 * 0.9 + 0.1
+    spread = int(round(REVERB_STEREO_SPREAD * stereo_depth / 100.0))
+    rate = sr / 44100.0
+
+    # long enough for the longest comb to decay by 60dB
+    longest = int((max(REVERB_COMB_LENGTHS) + spread) * scale * rate) + 1
+    frames = longest * int(math.ceil(math.log(0.001) / math.log(max(feedback, 1e-6)))) + longest
+    frames = min(frames, int(maxDur * sr))
+
+    # run an impulse through 8 parallel combs and 4 allpasses per channel
+    impulse = np.zeros(frames)
+    impulse[0] = REVERB_INPUT_GAIN
+    channels = []
+    for offset in (0, spread):
+        y = np.zeros(frames)
+        for length in REVERB_COMB_LENGTHS:
+            y += combFilter(impulse, max(int((length + offset) * scale * rate), 1), feedback, damp)
+        for length in REVERB_ALLPASS_LENGTHS:
+            y = allpassFilter(y, max(int((length + offset) * rate), 1))
+        channels.append(y)
+    impulse = np.column_stack(channels)
+
+    REVERB_IMPULSES[key] = impulse
+    return impulse
+
+def getSampleData(slices, rmse, rolloffs, ylen, sr, hop_length, basename, groupName=""):
+    duration = ylen/sr
+    sampleData = []
+    for i, slice in enumerate(slices):
+        left, right = tuple(slice)
+        # frames left..right inclusive, the frames an stft of y[left*hop:right*hop] has, as in getFeatureVectors()
+        stft = rmse[left:right+1]
+        rolloff = rolloffs[left:right+1]
+        # notes = [librosa.hz_to_note(hz) for hz in rolloff]
+        # pprint(notes)
+        start = round(1.0 * (left*hop_length) / ylen, 5)
+        end =  round(1.0 * (right*hop_length) / ylen, 5)
+        dur = int(round((end - start) * duration * 1000))
+        power = round(weighted_mean(stft), 2)
+        hz = round(weighted_mean(rolloff), 2)
+        note = librosa.hz_to_note(hz)
+        startms = int(round(start * duration * 1000))
+        sampleFilename = "%s %s.wav" % (basename, startms)
+
+        # parse note
+        octave = -1
+        matches = re.match("([A-Z]\#?b?)(\-?[0-9]+)", note)
+        if matches:
+            note = matches.group(1)
+            octave = int(matches.group(2))
+
+        sampleData.append({
+            "index": i,
+            "parent": basename,
+            "group": groupName,
+            "filename": sampleFilename,
+            "start": startms,
+            "dur": dur,
+            "power": power,
+            "hz": hz,
+            "note": note,
+            "octave": octave,
+            "left": left,
+            "right": right
+        })
+        # print("pos=%s, dur=%s, hz=%s (%s) power=%s" % (start, dur, hz, note, power))
+    return sampleData
+
 def getSlices(e, ampMin, minLen, maxLen):
+    e = np.asarray(e)
     stdev = np.std(e)
     minAmp = min(stdev * 1.5, 0.5)
     if ampMin >= 0:
         minAmp = ampMin
-    slices = []
-    prev = None
-    start = None
-    end = None
-    for i, value in enumerate(e):
-        # first
-        if prev is None:
-            prev = value
-            continue
-        # we've hit the beginning of a slice
-        if prev < minAmp and value >= minAmp:
-            start = i
-        # we've hit the end of a slice
-        elif prev >= minAmp and value < minAmp:
-            end = i
-        # add slice
-        if start is not None and end is not None:
-            if end > start:
-                slices.append([start, end])
-            start = None
-            end = None
-        prev = value
-
-    maxIndex = len(e) - 1
-    # backtrack and look ahead
-    for i, slice in enumerate(slices):
-        left, right = tuple(slice)
-        # backtrack left
-        value = e[left]
-        j = left - 1
-        while j >= 0:
-            vnew = e[j]
-            if vnew < value:
-                value = vnew
-            else:
-                break
-            j -= 1
-        leftNew = max(j + 1, 0)
-        # look ahead right
-        value = e[right]
-        j = right + 1
-        while j <= maxIndex:
-            vnew = e[j]
-            if vnew < value:
-                value = vnew
-            else:
-                break
-            j += 1
-        rightNew = min(j - 1, maxIndex)
-        # update slice
-        slices[i] = [leftNew, rightNew]
+    if len(e) < 2:
+        return []
+
+    # find where we've hit the beginning and the end of a slice
+    prev = e[:-1]
+    value = e[1:]
+    starts = np.flatnonzero((prev < minAmp) & (value >= minAmp)) + 1
+    ends = np.flatnonzero((prev >= minAmp) & (value < minAmp)) + 1
+
+    # crossings alternate, so pair each start with the following end;
+    # if the envelope begins above the threshold every end precedes its start and nothing is added
+    if len(ends) > 0 and (len(starts) <= 0 or ends[0] < starts[0]):
+        return []
+    count = min(len(starts), len(ends))
+    starts = starts[:count]
+    ends = ends[:count]
+
+    n = len(e)
+    indices = np.arange(n)
+    # backtrack left: nearest index at or before i where stepping left no longer falls
+    falling = np.zeros(n, dtype=bool)
+    falling[1:] = e[:-1] < e[1:]
+    valleyLeft = np.maximum.accumulate(np.where(falling, 0, indices))
+    # look ahead right: nearest index at or after i where stepping right no longer falls
+    rising = np.zeros(n, dtype=bool)
+    rising[:-1] = e[1:] < e[:-1]
+    valleyRight = np.minimum.accumulate(np.where(rising, n - 1, indices)[::-1])[::-1]
+    lefts = valleyLeft[starts]
+    rights = valleyRight[ends]
 
     # remove slices that are too long or too short
-    slices = [s for s in slices if s[1]-s[0] >= minLen and s[1]-s[0] <= maxLen]
+    lengths = rights - lefts
+    valid = (lengths >= minLen) & (lengths <= maxLen)
+    slices = np.column_stack((lefts[valid], rights[valid])).tolist()
 
     return slices
 
+def readAudioRange(fn, start=0, dur=-1, sr=44100, channels=2):
+    # decodes only the window from start to start+dur (ms, dur <= 0 reads to the end)
+    # as a frames x channels float32 array
+    if fn.lower().endswith(".wav"):
+        y = readWavRange(fn, start, dur, sr, channels)
+        if y is not None:
+            return y
+
+    # seek before opening the input so ffmpeg skips straight to the window
+    command = ["ffmpeg", "-v", "error", "-ss", "%.3f" % (start / 1000.0)]
+    if dur > 0:
+        command += ["-t", "%.3f" % (dur / 1000.0)]
+    command += ["-i", fn, "-f", "f32le", "-ac", str(channels), "-ar", str(sr), "-"]
+    data = subprocess.check_output(command)
+    y = np.frombuffer(data[:len(data)//(4*channels)*(4*channels)], dtype=np.float32)
+    return y.reshape(-1, channels)
+
+def readWavRange(fn, start=0, dur=-1, sr=None, channels=2):
+    # memory-mapped PCM, so only the window is read from disk;
+    # returns None if the file needs decoding (other sample rate or a format scipy can't map)
+    try:
+        rate, data = wavfile.read(fn, mmap=True)
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+    if sr is not None and rate != sr:
+        return None
+    i0 = int(start * rate / 1000)
+    i1 = len(data) if dur <= 0 else int((start + dur) * rate / 1000)
+    y = np.array(data[i0:i1], dtype=np.float32)
+    # scale integer PCM to -1..1
+    if data.dtype == np.uint8:
+        y = (y - 128.0) / 128.0
+    elif data.dtype.kind == "i":
+        y /= 2 ** (data.dtype.itemsize * 8 - 1)
+    if y.ndim < 2:
+        y = y[:, np.newaxis]
+    if y.shape[1] != channels:
+        y = np.repeat(np.mean(y, axis=1, keepdims=True), channels, axis=1)
+    return y
+
+def segmentToArray(segment):
+    # frames x channels float32 in -1..1
+    maxValue = 2 ** (segment.sample_width * 8 - 1)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32) / maxValue
+    return samples.reshape(-1, segment.channels)
+
 def showAudioPlot(y, e, slices, filename="output_plot.png", figsize=(30,3), downsample=100):
     # # plot the raw waveform
     # plt.figure(figsize=figsize)
@@ -239,6 +504,72 @@ def showAudioPlot(y, e, slices, filename="output_plot.png", figsize=(30,3), down
     plt.savefig(filename, bbox_inches="tight", pad_inches=0)
     plt.close()
 
+def streamAudioSamples(fn, min_dur=0.05, max_dur=0.75, fft=2048, hop_length=512, amp_threshold=-1, plot=False, plotfilename="../data/output/plot.png", groupName="", cacheDir=AUDIO_CACHE_DIR, sr=22050, blockSize=2**20, select=None, withAudio=True):
+    basename = os.path.splitext(os.path.basename(fn))[0]
+
+    # first pass: build the frame envelope block by block
+    try:
+        rmse, rolloffs, ymax, ylen, sr = getAudioEnvelope(fn, sr=sr, fft=fft, hop_length=hop_length, blockSize=blockSize, cacheDir=cacheDir)
+    except Exception as e:
+        print("Error loading %s" % fn)
+        return
+
+    # return empty data if file read error
+    if ylen < 2:
+        return
+
+    # rmse scales with the audio, so this matches normalizing the audio by its max first
+    rmse = rmse / ymax
+
+    min_duration_frames = librosa.core.time_to_frames([min_dur], sr=sr, hop_length=hop_length)[0]
+    max_duration_frames = librosa.core.time_to_frames([max_dur], sr=sr, hop_length=hop_length)[0]
+
+    # normalize the rmse (root-mean-square energy) and threshold at a fixed value
+    e = rmse - rmse.min()
+    e /= e.max()
+
+    slices = getSlices(e, amp_threshold, min_duration_frames, max_duration_frames)
+    sampleData = getSampleData(slices, rmse, rolloffs, ylen, sr, hop_length, basename, groupName)
+
+    if plot:
+        showAudioPlot(None, e, slices, filename=plotfilename)
+
+    # let the caller choose which samples to emit, e.g. the ones with the most power
+    if select is not None:
+        sampleData = select(sampleData)
+
+    if not withAudio:
+        for d in sampleData:
+            yield (d, None)
+        return
+
+    # second pass: cut each sample out of the stream, only keeping audio from the next pending sample on
+    pending = sorted(sampleData, key=lambda k: k["left"])
+    pendingCount = len(pending)
+    i = 0
+    buf = np.zeros(0, dtype=np.float32)
+    offset = 0
+    for block in getAudioBlocks(fn, sr=sr, blockSize=blockSize, cacheDir=cacheDir):
+        if i >= pendingCount:
+            break
+        buf = np.concatenate((buf, block))
+        bufEnd = offset + len(buf)
+        while i < pendingCount and pending[i]["right"]*hop_length <= bufEnd:
+            d = pending[i]
+            yield (d, buf[d["left"]*hop_length-offset:d["right"]*hop_length-offset] / ymax)
+            i += 1
+        if i < pendingCount:
+            drop = min(pending[i]["left"]*hop_length - offset, len(buf))
+            if drop > 0:
+                buf = buf[drop:]
+                offset += drop
+
+    # samples whose last frame runs past the end of the audio
+    while i < pendingCount:
+        d = pending[i]
+        yield (d, buf[d["left"]*hop_length-offset:] / ymax)
+        i += 1
+
 def volumeToDb(volume):
     db = 0.0
     if volume < 1.0 or volume > 1.0:
@@ -249,6 +580,8 @@ def volumeToDb(volume):
 def writeMixFile(outputfile, instructions):
     # get sounds from instructions
     sounds = list(set([i["sound"] for i in instructions]))
+    # look up sound indices by name, a list search per instruction is too slow for large mixes
+    soundIndices = dict([(s, index) for index, s in enumerate(sounds)])
     print("%s sound files" % len(sounds))
     # build output file
     lines = []
@@ -256,7 +589,7 @@ def writeMixFile(outputfile, instructions):
         lines.append(s)
     lines.append("---")
     for i in instructions:
-        soundIndex = sounds.index(i["sound"])
+        soundIndex = soundIndices[i["sound"]]
         # define defaults
         clipStart = i["clipStart"] if "clipStart" in i else 0
         clipDur = i["clipDur"] if "clipDur" in i else -1
@@ -266,6 +599,9 @@ def writeMixFile(outputfile, instructions):
         fadeOut = i["fadeOut"] if "fadeOut" in i else 0
         # must at least have start and soundIndex
         row = [i["start"], soundIndex, clipStart, clipDur, volume, pan, fadeIn, fadeOut]
+        # optional effect send level
+        if "send" in i:
+            row.append(i["send"])
         row = [str(col) for col in row]
         line = ",".join(row)
         lines.append(line)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import librosa
+import numpy as np
+import os
+
+AUDIO_CACHE_DIR = "../data/cache/audio/"
+AUDIO_CACHE_MAX_BYTES = 50 * 1024**3
+# pruning goes below the cap, so the cache dir is walked once per few GB written rather than on every write
+AUDIO_CACHE_PRUNE_RATIO = 0.9
+# per-process estimate of each cache dir's size in bytes
+AUDIO_CACHE_SIZES = {}
+
+def addAudioCacheBytes(cacheDir, size, maxBytes=AUDIO_CACHE_MAX_BYTES):
+    # only walk the cache dir when the running estimate says it may be full;
+    # the first write in a process walks it once to learn what other runs left there
+    key = os.path.abspath(cacheDir)
+    if key not in AUDIO_CACHE_SIZES:
+        AUDIO_CACHE_SIZES[key] = sum([e[2] for e in listAudioCache(cacheDir)])
+    else:
+        AUDIO_CACHE_SIZES[key] += size
+    if maxBytes is not None and maxBytes >= 0 and AUDIO_CACHE_SIZES[key] > maxBytes:
+        pruneAudioCache(cacheDir, maxBytes)
+
+def getAudioCacheFilename(fn, sr, dtype, cacheDir=AUDIO_CACHE_DIR):
+    # key on everything that changes the decoded result
+    path = os.path.abspath(fn)
+    stat = os.stat(path)
+    key = "%s|%s|%s|%s|%s" % (path, stat.st_mtime, stat.st_size, sr, np.dtype(dtype).name)
+    if not isinstance(key, bytes):
+        key = key.encode("utf-8")
+    return os.path.join(cacheDir, hashlib.md5(key).hexdigest() + ".npy")
+
+def getAudioDuration(fn, sr=22050, dtype=np.float32, cacheDir=AUDIO_CACHE_DIR, maxBytes=AUDIO_CACHE_MAX_BYTES):
+    y, sr = loadAudio(fn, sr=sr, dtype=dtype, cacheDir=cacheDir, maxBytes=maxBytes)
+    return 1.0 * len(y) / sr
+
+def listAudioCache(cacheDir=AUDIO_CACHE_DIR):
+    entries = []
+    if not os.path.isdir(cacheDir):
+        return entries
+    for fn in os.listdir(cacheDir):
+        if not fn.endswith(".npy"):
+            continue
+        path = os.path.join(cacheDir, fn)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed by another process
+            continue
+        entries.append((path, stat.st_mtime, stat.st_size))
+    return entries
+
+def loadAudio(fn, sr=22050, dtype=np.float32, cacheDir=AUDIO_CACHE_DIR, maxBytes=AUDIO_CACHE_MAX_BYTES, mmap=True):
+    # no cache, just decode
+    if not cacheDir:
+        return librosa.load(fn, sr=sr, dtype=dtype)
+
+    cacheFn = getAudioCacheFilename(fn, sr, dtype, cacheDir)
+
+    # cache hit: mark as recently used and return a memory-mapped array
+    if os.path.isfile(cacheFn):
+        try:
+            y = np.load(cacheFn, mmap_mode=("r" if mmap else None))
+            os.utime(cacheFn, None)
+            return (y, sr)
+        except (IOError, OSError, ValueError):
+            print("Invalid cache file for %s, decoding again" % fn)
+
+    y, sr = librosa.load(fn, sr=sr, dtype=dtype)
+
+    # write to a temp file first so other processes never read a partial file
+    try:
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+    except OSError:
+        pass
+    tmpFn = "%s.%s.tmp" % (cacheFn, os.getpid())
+    try:
+        with open(tmpFn, 'wb') as f:
+            np.save(f, y)
+        os.rename(tmpFn, cacheFn)
+    except (IOError, OSError):
+        print("Could not write cache file for %s" % fn)
+        if os.path.isfile(tmpFn):
+            os.remove(tmpFn)
+    else:
+        addAudioCacheBytes(cacheDir, os.path.getsize(cacheFn), maxBytes)
+
+    return (y, sr)
+
+def pruneAudioCache(cacheDir=AUDIO_CACHE_DIR, maxBytes=AUDIO_CACHE_MAX_BYTES):
+    if maxBytes is None or maxBytes < 0:
+        return 0
+    entries = listAudioCache(cacheDir)
+    size = sum([e[2] for e in entries])
+    removed = 0
+
+    # evict least recently used first, down to a bit below the cap
+    if size > maxBytes:
+        targetBytes = maxBytes * AUDIO_CACHE_PRUNE_RATIO
+        entries = sorted(entries, key=lambda e: e[1])
+        for path, mtime, fsize in entries:
+            if size <= targetBytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # removed by another process
+                pass
+            size -= fsize
+
+    AUDIO_CACHE_SIZES[os.path.abspath(cacheDir)] = size
+    return removed
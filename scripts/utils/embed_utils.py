@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+from feature_utils import FEATURE_COLUMNS
+from knn_utils import getNearestNeighbors
+import multiprocessing
+import numpy as np
+import os
+import time
+
+# auto uses the fastest t-SNE that is installed
+EMBEDDING_METHODS = ["auto", "tsne", "opentsne", "multicore", "umap", "pca"]
+
+def getConditionalProbabilities(distances, perplexity=5.0, steps=64):
+    # gaussian neighbour probabilities per row, with each row's bandwidth searched to match the perplexity
+    d2 = np.asarray(distances, dtype=np.float64)**2
+    d2 = d2 - d2[:, :1]
+    target = np.log(min(perplexity, d2.shape[1]))
+    lo = np.full(len(d2), -50.0)
+    hi = np.full(len(d2), 50.0)
+    for i in range(steps):
+        mid = (lo + hi) / 2.0
+        beta = np.exp(mid)
+        P = np.exp(-d2 * beta[:, np.newaxis])
+        sums = P.sum(axis=1)
+        entropy = np.log(sums) + beta * (d2 * P).sum(axis=1) / sums
+        # too much entropy means the kernel is too wide, so search higher precisions
+        tooWide = entropy > target
+        lo = np.where(tooWide, mid, lo)
+        hi = np.where(tooWide, hi, mid)
+    return P / sums[:, np.newaxis]
+
+def getEmbedding(featureVectors, method="tsne", pca=-1, learningRate=150, angle=0.1, perplexity=30.0, seed=1, threads=-1, verbose=1):
+    # featureVectors is a samples x features matrix; returns samples x 2
+    # pca > 0 first reduces the features to that many components, which speeds up the neighbour search
+    # learningRate <= 0 scales it with the sample count, which large maps need to converge
+    X = np.asarray(featureVectors, dtype=np.float64)
+    learningRate = learningRate if learningRate > 0 else max(len(X) / 12.0, 50.0)
+    method = getEmbeddingMethod(method)
+    threads = threads if threads > 0 else multiprocessing.cpu_count()
+    t0 = time.time()
+
+    if 0 < pca < X.shape[1]:
+        X = reducePCA(X, pca)
+
+    if method == "pca":
+        model = reducePCA(X, 2)
+
+    elif method == "opentsne":
+        from openTSNE import TSNE
+        model = np.asarray(TSNE(n_components=2,
+                                perplexity=perplexity,
+                                learning_rate=learningRate,
+                                # interpolates the repulsive forces on a grid, which scales to millions of points
+                                negative_gradient_method="fft",
+                                n_jobs=threads,
+                                random_state=seed,
+                                verbose=(verbose > 0)
+        ).fit(X))
+
+    elif method == "multicore":
+        from MulticoreTSNE import MulticoreTSNE
+        model = MulticoreTSNE(n_components=2,
+                              perplexity=perplexity,
+                              learning_rate=learningRate,
+                              angle=angle,
+                              n_jobs=threads,
+                              random_state=seed,
+                              verbose=verbose
+        ).fit_transform(X)
+
+    elif method == "umap":
+        import umap
+        # a fixed seed makes umap run single-threaded
+        model = umap.UMAP(n_components=2, random_state=seed, verbose=(verbose > 0)).fit_transform(X)
+
+    else:
+        # imported here so scripts that don't embed don't need scikit-learn
+        from sklearn.manifold import TSNE
+        model = TSNE(n_components=2,
+                     perplexity=perplexity,
+                     learning_rate=learningRate, # increase if too dense, decrease if too uniform
+                     verbose=verbose,
+                     angle=angle, # increase to make faster, decrease to make more accurate
+                     random_state=seed
+        ).fit_transform(X)
+
+    print("Embedded %s samples with %s in %ss" % (len(X), method, round(time.time() - t0, 2)))
+    return model
+
+def getEmbeddingBounds(model):
+    model = np.asarray(model, dtype=float)
+    return np.array([np.min(model, axis=0), np.max(model, axis=0)])
+
+def getEmbeddingMethod(method):
+    if method not in EMBEDDING_METHODS:
+        raise ValueError("Unknown embedding method %s, use one of: %s" % (method, ", ".join(EMBEDDING_METHODS)))
+    if method != "auto":
+        return method
+    try:
+        import openTSNE
+        return "opentsne"
+    except ImportError:
+        pass
+    try:
+        import MulticoreTSNE
+        return "multicore"
+    except ImportError:
+        pass
+    return "tsne"
+
+def normalizeEmbedding(model, bounds=None):
+    # with bounds from an earlier embedding, points outside them are clipped to the edges
+    model = np.array(model, dtype=float)
+    if bounds is None:
+        bounds = getEmbeddingBounds(model)
+    minValues, maxValues = bounds
+    normalized = (model - minValues) / (maxValues - minValues)
+    return np.clip(normalized, 0.0, 1.0)
+
+def placeEmbedding(embedding, vectors, newVectors, perplexity=5.0, k=-1, iterations=100, learningRate=1.0, sampleSize=2000, batchSize=256, seed=1):
+    # places new points into an existing 2d embedding without moving the existing points:
+    # each starts at the probability-weighted mean of its nearest neighbours (in feature space),
+    # then follows the t-SNE gradient of its own neighbour distribution against the fixed map
+    embedding = np.asarray(embedding, dtype=np.float64)
+    newVectors = np.asarray(newVectors, dtype=np.float32).reshape(-1, np.shape(vectors)[1])
+    k = k if k > 0 else int(3 * perplexity)
+    t0 = time.time()
+    neighbors, distances = getNearestNeighbors(vectors, newVectors, k)
+    P = getConditionalProbabilities(distances, perplexity)
+
+    # repulsion from the whole map is estimated from a fixed random subset of it
+    count = len(embedding)
+    rng = np.random.RandomState(seed)
+    subset = embedding if count <= sampleSize else embedding[rng.choice(count, sampleSize, replace=False)]
+    scale = 1.0 * count / len(subset)
+
+    placed = np.zeros((len(newVectors), 2))
+    for i0 in range(0, len(newVectors), batchSize):
+        p = P[i0:i0+batchSize]
+        neighborY = embedding[neighbors[i0:i0+batchSize]]
+        y = np.sum(p[:, :, np.newaxis] * neighborY, axis=1)
+        update = np.zeros_like(y)
+        for i in range(iterations):
+            dN = y[:, np.newaxis, :] - neighborY
+            wN = 1.0 / (1.0 + np.sum(dN**2, axis=2))
+            dS = y[:, np.newaxis, :] - subset[np.newaxis, :, :]
+            wS = 1.0 / (1.0 + np.sum(dS**2, axis=2))
+            Z = scale * np.sum(wS, axis=1)[:, np.newaxis]
+            # gradient of KL(p || q) with q the student-t similarities to every point of the map
+            attraction = np.sum((p * wN)[:, :, np.newaxis] * dN, axis=1)
+            repulsion = scale * np.sum((wS**2 / Z)[:, :, np.newaxis] * dS, axis=1)
+            gradient = 2.0 * (attraction - repulsion)
+            momentum = 0.5 if i < 20 else 0.8
+            update = momentum * update - learningRate * gradient
+            y += update
+        placed[i0:i0+len(y)] = y
+
+    print("Placed %s samples in %ss" % (len(placed), round(time.time() - t0, 2)))
+    return placed
+
+def readEmbedding(filename):
+    # raw 2d embedding, the feature vectors it was made from, its sample index and normalization bounds
+    with open(filename, 'rb') as f:
+        data = dict(np.load(f))
+    return data
+
+def reducePCA(X, components):
+    # eigenvectors of the features x features covariance, so it stays cheap for millions of samples
+    X = X - X.mean(axis=0)
+    values, vectors = np.linalg.eigh(X.T.dot(X))
+    vectors = vectors[:, np.argsort(values)[::-1][:components]]
+    # make the signs deterministic
+    vectors *= np.sign(vectors[np.argmax(np.abs(vectors), axis=0), np.arange(vectors.shape[1])])
+    return X.dot(vectors)
+
+def writeEmbedding(filename, model, data, vectors, bounds):
+    dirname = os.path.dirname(filename)
+    if len(dirname) > 0 and not os.path.exists(dirname):
+        os.makedirs(dirname)
+    columns = dict([(key, np.asarray(data[key])) for key in FEATURE_COLUMNS])
+    with open(filename, 'wb') as f:
+        np.savez(f, embedding=np.asarray(model, dtype=np.float64), vectors=np.asarray(vectors, dtype=np.float32), bounds=np.asarray(bounds, dtype=np.float64), **columns)
+    print("Wrote embedding of %s samples to %s" % (len(model), filename))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+# Feature vectors are stored as one matrix (vectors.npy, a row per sample) next to a column store
+# index of the samples (index/), the parameters that produced them (params.json) and a manifest
+# of the audio files they came from (manifest.json)
+
+from io_utils import isColumnStore, readColumns, writeColumns
+import json
+from manifest_utils import readManifest, writeManifest
+import numpy as np
+import os
+
+FEATURE_COLUMNS = ["parent", "group", "note", "start", "dur"]
+FEATURE_PARAMS_FILE = "params.json"
+FEATURE_MANIFEST_FILE = "manifest.json"
+
+def getFeatureKeys(data):
+    # samples are identified by their parent file and group
+    return zip(data["parent"], data["group"])
+
+def isFeatureStore(dirname):
+    return isColumnStore(os.path.join(dirname, "index")) and os.path.isfile(os.path.join(dirname, "vectors.npy"))
+
+def readFeatures(dirname, mmap=True):
+    # returns (index columns, vectors, params, manifest); vectors are memory-mapped read-only
+    if not isFeatureStore(dirname):
+        return (dict([(key, np.array([])) for key in FEATURE_COLUMNS]), None, None, {})
+    data = readColumns(os.path.join(dirname, "index"), mmap=mmap)
+    vectors = np.load(os.path.join(dirname, "vectors.npy"), mmap_mode=("r" if mmap else None))
+    params = None
+    paramsFile = os.path.join(dirname, FEATURE_PARAMS_FILE)
+    if os.path.isfile(paramsFile):
+        with open(paramsFile) as f:
+            params = json.load(f)
+    manifest = readManifest(os.path.join(dirname, FEATURE_MANIFEST_FILE))
+    return (data, vectors, params, manifest)
+
+def selectFeatures(data, vectors, indices):
+    # copies, so the result stays valid after the store it was read from is rewritten
+    indices = np.asarray(indices, dtype=np.int64)
+    selected = dict([(key, np.array(data[key][indices])) for key in FEATURE_COLUMNS])
+    return (selected, np.array(vectors[indices]))
+
+def writeFeatures(dirname, data, vectors, params, manifest=None, dtype=np.float32):
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    writeColumns(os.path.join(dirname, "index"), data, FEATURE_COLUMNS)
+    # write to a temp file first, a memory-mapped copy of the old matrix may still be open
+    vectorsFile = os.path.join(dirname, "vectors.npy")
+    tmpFilename = vectorsFile + ".tmp"
+    with open(tmpFilename, 'wb') as f:
+        np.save(f, np.asarray(vectors, dtype=dtype))
+    os.rename(tmpFilename, vectorsFile)
+    with open(os.path.join(dirname, FEATURE_PARAMS_FILE), 'w') as f:
+        json.dump(params, f, indent=1, sort_keys=True)
+    if manifest is not None:
+        writeManifest(os.path.join(dirname, FEATURE_MANIFEST_FILE), manifest)
+    print("Wrote %s feature vectors to %s" % (len(vectors), dirname))
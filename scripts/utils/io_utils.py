@@ -3,8 +3,123 @@
 import csv
 import glob
 import json
+import numpy as np
 import os
 
+COLUMNS_META_FILE = "columns.json"
+
+# column types of the data files the scripts write; other columns are read as strings
+SCHEMAS = {
+    "chords": {"chord": int, "clef": str, "note": str, "octave": int},
+    "metadata": {"filename": str, "uid": str, "name": str, "species": str, "description": str, "groups": str, "sample": int, "duration": float, "state": str, "country": str, "placecode": str, "date": str, "authors": str},
+    "phrases": {"parent": str, "start": int, "dur": int, "phrase": str},
+    "phrase_stats": {"parent": str, "start": int, "dur": int, "count": int, "hzMean": int, "durMean": int, "powMean": float, "hzStd": int, "beatStd": int, "notes": str},
+    "samples": {"parent": str, "group": str, "start": int, "dur": int, "power": float, "hz": float, "note": str, "octave": int},
+    "tsne": {"parent": str, "group": str, "start": int, "dur": int, "x": float, "y": float}
+}
+
+class EncodedColumn(object):
+    # a dictionary-encoded string column: integer codes (memory-mapped) into a sorted list of unique values;
+    # strings are only decoded for the rows that are accessed, so selecting a few rows of a large store is cheap
+    def __init__(self, codes, dictionary):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.decode()
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, key):
+        return self.dictionary[self.codes[key]]
+
+    def __iter__(self):
+        for i in range(0, len(self.codes), 2**16):
+            for value in self.dictionary[self.codes[i:i+2**16]]:
+                yield value
+
+    def __len__(self):
+        return len(self.codes)
+
+    def astype(self, dtype):
+        return self.decode().astype(dtype)
+
+    def decode(self):
+        return self.dictionary[self.codes]
+
+    def tolist(self):
+        return self.decode().tolist()
+
+def castColumn(values, cast, filename="", key=""):
+    # values is an array of strings; casts the whole column at once
+    if cast is str:
+        return values
+    try:
+        if cast is int:
+            try:
+                return values.astype(np.int64)
+            except ValueError:
+                # ints may be written as floats, e.g. "12.0"
+                return values.astype(np.float64).astype(np.int64)
+        if cast is float:
+            return values.astype(np.float64)
+    except ValueError:
+        pass
+    # cast cell by cell to find the first bad one
+    return np.array([castValue(value, cast, filename, key, i+1) for i, value in enumerate(values.tolist())])
+
+def castValue(value, cast, filename="", key="", row=-1):
+    # row counts data rows from 1, after the heading and comments
+    if cast is str:
+        return value
+    try:
+        if cast is int:
+            try:
+                return int(value)
+            except ValueError:
+                return int(float(value))
+        return cast(value)
+    except ValueError:
+        problem = "empty" if len(value.strip()) <= 0 else "invalid %s %r" % (cast.__name__, value)
+        raise ValueError("%s, column %s, row %s: %s value" % (filename, key, row, problem))
+
+def getSchema(schema):
+    if schema is None:
+        return {}
+    if isinstance(schema, dict):
+        return schema
+    return SCHEMAS[schema]
+
+def isColumnStore(path):
+    return os.path.isfile(os.path.join(path, COLUMNS_META_FILE))
+
+def iterCsv(filename, schema=None, columns=None):
+    schema = getSchema(schema)
+    with open(filename, 'rb') as f:
+        lines = (line for line in f if not line.startswith("#"))
+        reader = csv.reader(lines, skipinitialspace=True)
+        headings = next(reader, None)
+        if headings is None:
+            return
+        fields = [(i, key, schema.get(key, str)) for i, key in enumerate(headings) if columns is None or key in columns]
+        rowNumber = 0
+        for row in reader:
+            if len(row) <= 0:
+                continue
+            rowNumber += 1
+            item = {}
+            for i, key, cast in fields:
+                item[key] = row[i] if cast is str else castValue(row[i], cast, filename, key, rowNumber)
+            yield item
+
+def loadColumns(filename, columns=None, schema=None):
+    # read a column store, or a csv file into the same arrays
+    if isColumnStore(filename):
+        return readColumns(filename, columns=columns)
+    if schema is not None:
+        return readCsvColumns(filename, schema=schema, columns=columns)
+    rows = readCsv(filename)
+    return rowsToColumns(rows, columns)
+
 def parseHeadings(arr, headings):
     newArr = []
     headingKeys = [key for key in headings]
@@ -45,8 +160,15 @@ def readFiles(inputString, dirString=""):
                 files += [dirString % fn for fn in json.load(f)]
     return (fileGroups, files)
 
-def readCsv(filename, headings=False, doParseNumbers=True):
+def readCsv(filename, headings=False, doParseNumbers=True, schema=None, columns=None):
     rows = []
+    # typed rows from a known schema, without guessing each value's type
+    if schema is not None:
+        if os.path.isfile(filename):
+            rows = list(iterCsv(filename, schema=schema, columns=columns))
+            if headings:
+                rows = parseHeadings(rows, headings)
+        return rows
     if os.path.isfile(filename):
         with open(filename, 'rb') as f:
             lines = [line for line in f if not line.startswith("#")]
@@ -57,3 +179,69 @@ def readCsv(filename, headings=False, doParseNumbers=True):
             if doParseNumbers:
                 rows = parseNumbers(rows)
     return rows
+
+def readColumns(dirname, columns=None, mmap=True):
+    with open(os.path.join(dirname, COLUMNS_META_FILE)) as f:
+        meta = json.load(f)
+    mmapMode = "r" if mmap else None
+    data = {}
+    for col in meta["columns"]:
+        name = col["name"]
+        if columns is not None and name not in columns:
+            continue
+        values = np.load(os.path.join(dirname, name + ".npy"), mmap_mode=mmapMode)
+        # dictionary-encoded strings are decoded on access
+        if col["encoded"]:
+            values = EncodedColumn(values, np.load(os.path.join(dirname, name + ".values.npy")))
+        data[name] = values
+    return data
+
+def readCsvColumns(filename, schema=None, columns=None):
+    schema = getSchema(schema)
+    with open(filename, 'rb') as f:
+        lines = (line for line in f if not line.startswith("#"))
+        reader = csv.reader(lines, skipinitialspace=True)
+        headings = next(reader, [])
+        rows = [row for row in reader if len(row) > 0]
+
+    # transpose, then convert each column in one step
+    values = list(zip(*rows)) if len(rows) > 0 else [() for key in headings]
+    data = {}
+    for i, key in enumerate(headings):
+        if columns is not None and key not in columns:
+            continue
+        data[key] = castColumn(np.array(values[i], dtype=str), schema.get(key, str), filename, key)
+    return data
+
+def rowsToColumns(rows, headings=None):
+    if headings is None:
+        headings = list(rows[0].keys()) if len(rows) > 0 else []
+    data = {}
+    for key in headings:
+        data[key] = np.array([row[key] for row in rows])
+    return data
+
+def writeColumns(dirname, rows, headings=None):
+    # rows can be a list of dicts or a dict of column arrays
+    data = rows if isinstance(rows, dict) else rowsToColumns(rows, headings)
+    if headings is None:
+        headings = sorted(data.keys())
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    meta = {"columns": [], "rows": 0}
+    for name in headings:
+        values = np.asarray(data[name])
+        encoded = values.dtype.kind in ("S", "U", "O")
+        # dictionary-encode strings as integer codes into a sorted list of unique values
+        if encoded:
+            dictionary, codes = np.unique(values.astype(str), return_inverse=True)
+            np.save(os.path.join(dirname, name + ".values.npy"), dictionary)
+            values = codes.astype(np.int32)
+        np.save(os.path.join(dirname, name + ".npy"), values)
+        meta["columns"].append({"name": name, "encoded": encoded, "dtype": values.dtype.str})
+        meta["rows"] = len(values)
+
+    with open(os.path.join(dirname, COLUMNS_META_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+    print("Wrote %s rows to %s" % (meta["rows"], dirname))
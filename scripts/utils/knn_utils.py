@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+from feature_utils import readFeatures
+import numpy as np
+import os
+import pickle
+
+# a knn index is a feature store (see feature_utils) plus the squared norms of its vectors
+# and, optionally, a pickled scikit-learn BallTree
+KNN_NORMS_FILE = "norms.npy"
+KNN_TREE_FILE = "balltree.pkl"
+
+def buildKnnIndex(dirname, tree=False, leafSize=40):
+    data, vectors, params, manifest = readFeatures(dirname)
+    if vectors is None:
+        raise ValueError("No feature store at %s" % dirname)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    np.save(os.path.join(dirname, KNN_NORMS_FILE), np.einsum("ij,ij->i", vectors, vectors))
+    treeFile = os.path.join(dirname, KNN_TREE_FILE)
+    if tree:
+        # imported here so brute force search doesn't need scikit-learn
+        from sklearn.neighbors import BallTree
+        with open(treeFile, 'wb') as f:
+            pickle.dump(BallTree(vectors, leaf_size=leafSize), f, pickle.HIGHEST_PROTOCOL)
+    elif os.path.isfile(treeFile):
+        os.remove(treeFile)
+    print("Built %s index of %s vectors in %s" % ("ball tree" if tree else "brute force", len(vectors), dirname))
+
+def getNearestNeighbors(X, queries, k=10, norms=None, memoryBytes=2**28):
+    # brute force: squared distances as |q|^2 - 2 q.x + |x|^2, one matrix product per batch of queries
+    # returns (indices, distances) of the k nearest rows of X for each query, nearest first
+    X = np.asarray(X, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32).reshape(-1, X.shape[1])
+    k = min(k, len(X))
+    if norms is None:
+        norms = np.einsum("ij,ij->i", X, X)
+    # each batch holds a float32 distance matrix and, briefly, the int64 partition of it
+    batchSize = max(1, memoryBytes // (12 * len(X)))
+    indices = np.zeros((len(queries), k), dtype=np.int64)
+    distances = np.zeros((len(queries), k), dtype=np.float32)
+    for i0 in range(0, len(queries), batchSize):
+        batch = queries[i0:i0+batchSize]
+        d2 = batch.dot(X.T)
+        d2 *= -2.0
+        d2 += norms[np.newaxis, :]
+        # partition out the k smallest, keeping only those columns so the full partition can be freed
+        if k < len(X):
+            nearest = np.array(np.argpartition(d2, k-1, axis=1)[:, :k])
+        else:
+            nearest = np.tile(np.arange(len(X)), (len(batch), 1))
+        rows = np.arange(len(batch))[:, np.newaxis]
+        nearestD2 = d2[rows, nearest]
+        del d2
+        order = np.argsort(nearestD2, axis=1)
+        indices[i0:i0+len(batch)] = nearest[rows, order]
+        batchNorms = np.einsum("ij,ij->i", batch, batch)[:, np.newaxis]
+        distances[i0:i0+len(batch)] = np.sqrt(np.maximum(nearestD2[rows, order] + batchNorms, 0))
+    return (indices, distances)
+
+def getSampleIndices(data):
+    # (parent, start) -> row
+    return dict([((parent, int(start)), i) for i, (parent, start) in enumerate(zip(data["parent"], data["start"]))])
+
+def queryKnnIndex(index, queries, k=10, memoryBytes=2**28):
+    # returns (indices, distances) of the k nearest samples for each query vector
+    if index["tree"] is not None:
+        distances, indices = index["tree"].query(np.asarray(queries, dtype=np.float32).reshape(-1, index["vectors"].shape[1]), k=min(k, len(index["vectors"])))
+        return (indices, distances)
+    return getNearestNeighbors(index["vectors"], queries, k, norms=index["norms"], memoryBytes=memoryBytes)
+
+def readKnnIndex(dirname, mmap=True):
+    data, vectors, params, manifest = readFeatures(dirname, mmap=mmap)
+    if vectors is None:
+        raise ValueError("No feature store at %s" % dirname)
+    norms = None
+    normsFile = os.path.join(dirname, KNN_NORMS_FILE)
+    vectorsFile = os.path.join(dirname, "vectors.npy")
+    # norms are stale if the store was rewritten after the index was built
+    if os.path.isfile(normsFile) and os.path.getmtime(normsFile) >= os.path.getmtime(vectorsFile):
+        norms = np.load(normsFile, mmap_mode=("r" if mmap else None))
+    if norms is None or len(norms) != len(vectors):
+        buildKnnIndex(dirname)
+        norms = np.load(normsFile)
+    tree = None
+    treeFile = os.path.join(dirname, KNN_TREE_FILE)
+    if os.path.isfile(treeFile) and os.path.getmtime(treeFile) >= os.path.getmtime(vectorsFile):
+        with open(treeFile, 'rb') as f:
+            tree = pickle.load(f)
+    # brute force search runs in float32 either way
+    if vectors.dtype != np.float32:
+        vectors = np.asarray(vectors, dtype=np.float32)
+    return {"data": data, "vectors": vectors, "norms": norms, "tree": tree, "params": params}
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+from pool_utils import runPool
+
+def getFileHash(fn, blockSize=2**20):
+    md5 = hashlib.md5()
+    with open(fn, 'rb') as f:
+        while True:
+            data = f.read(blockSize)
+            if not data:
+                break
+            md5.update(data)
+    return md5.hexdigest()
+
+def getManifestChanges(files, manifest, params, workers=-1):
+    entries = {}
+    toHash = []
+    for fn in files:
+        key = getManifestKey(fn)
+        stat = os.stat(fn)
+        entry = manifest.get(key)
+        # only hash files whose size or modified time changed
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            entries[key] = dict(entry)
+        else:
+            entries[key] = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": None}
+            toHash.append(fn)
+
+    if len(toHash) > 0:
+        print("Hashing %s new or modified files..." % len(toHash))
+        hashes = runPool(getFileHash, toHash, workers=workers)
+        print("")
+        for fn, fileHash in zip(toHash, hashes):
+            entries[getManifestKey(fn)]["hash"] = fileHash
+
+    # process files that are new, whose content changed, or that ran with other parameters
+    changed = []
+    for fn in files:
+        key = getManifestKey(fn)
+        entry = entries[key]
+        prev = manifest.get(key)
+        if prev is None or entry["hash"] is None or prev.get("hash") != entry["hash"] or prev.get("params") != params:
+            changed.append(fn)
+        entry["params"] = params
+
+    return (changed, entries)
+
+def getManifestKey(fn):
+    return os.path.abspath(fn)
+
+def readManifest(filename):
+    manifest = {}
+    if os.path.isfile(filename):
+        with open(filename) as f:
+            manifest = json.load(f)
+    return manifest
+
+def writeManifest(filename, manifest):
+    # write to a temp file first so an interrupted run never leaves a partial manifest
+    tmpFilename = filename + ".tmp"
+    with open(tmpFilename, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.rename(tmpFilename, filename)
+    print("Wrote manifest with %s files to %s" % (len(manifest), filename))
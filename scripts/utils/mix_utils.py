@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+# Mixes clips into one preallocated float32 stereo buffer instead of overlaying pydub segments,
+# which copies the whole track for every clip
+
+from audio_utils import readAudioRange
+import hashlib
+import json
+import numpy as np
+import os
+import Queue
+import struct
+import subprocess
+import sys
+import threading
+
+MIX_CACHE_DIR = "../data/cache/mix/"
+MIX_EVENT_KEYS = ["start", "clip", "gain", "pan", "fadeIn", "fadeOut", "send"]
+
+def blockToPcm(block, sampleWidth=2):
+    # interleaved little-endian integer PCM bytes
+    maxValue = 2 ** (sampleWidth * 8 - 1)
+    return np.clip(np.round(block * maxValue), -maxValue, maxValue - 1).astype("<i%s" % sampleWidth).tobytes()
+
+def compileMix(filename, audioDir="%s", padLeft=0, minVolume=0.01, maxVolume=10.0, cacheDir=MIX_CACHE_DIR):
+    # turn a mix file into a clip table and time-sorted event arrays; times are in ms
+    params = {"audioDir": audioDir, "padLeft": padLeft, "minVolume": minVolume, "maxVolume": maxVolume}
+    cacheFn = getMixCacheFilename(filename, params, cacheDir) if cacheDir else None
+    if cacheFn and os.path.isfile(cacheFn):
+        with np.load(cacheFn) as cached:
+            return dict([(key, cached[key]) for key in cached.files])
+
+    soundFiles, rows = readMixFile(filename)
+    start, soundIndex, clipStart, clipDur, volume, pan, fadeIn, fadeOut, send = rows
+
+    # drop silent events and cap volume, then convert volume to a linear gain like volumeToDb() + apply_gain()
+    valid = volume >= minVolume
+    volume = np.minimum(volume[valid], maxVolume)
+    db = np.where(volume != 1.0, 10.0 * np.log(np.maximum(volume, 1e-9)**2), 0.0)
+    gain = 10.0 ** (db / 20.0)
+
+    # unique clips get integer ids
+    clips = np.column_stack([soundIndex[valid], clipStart[valid], clipDur[valid]])
+    clipTable, clipIds = np.unique(clips.reshape(-1, 3), axis=0, return_inverse=True)
+    clipIds = clipIds.reshape(-1)
+
+    plan = {
+        "files": np.array([audioDir % fn for fn in soundFiles]),
+        "clipSound": clipTable[:, 0].astype(np.int32),
+        "clipStart": clipTable[:, 1].astype(np.int64),
+        "clipDur": clipTable[:, 2].astype(np.int64),
+        "start": start[valid] + padLeft,
+        "clip": clipIds.astype(np.int32),
+        "gain": gain.astype(np.float32),
+        "pan": pan[valid].astype(np.float32),
+        "fadeIn": fadeIn[valid],
+        "fadeOut": fadeOut[valid],
+        "send": send[valid].astype(np.float32)
+    }
+    plan = selectMixEvents(plan, np.argsort(plan["start"], kind="mergesort"))
+
+    if cacheFn:
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+        # write to a temp file first so a partial plan is never read
+        tmpFn = cacheFn + ".tmp.npz"
+        np.savez(tmpFn, **plan)
+        os.rename(tmpFn, cacheFn)
+    return plan
+
+def getClipGains(gain=1.0, pan=0.0):
+    # same pan law as pydub's AudioSegment.pan(): boost the loud side by half of 6dB * pan,
+    # reduce the quiet side to 2 - 2^pan
+    boost = 2.0 ** (abs(pan) / 2.0)
+    reduce = 2.0 - 2.0 ** abs(pan)
+    left, right = (boost, reduce) if pan < 0 else (reduce, boost)
+    return np.array([left * gain, right * gain], dtype=np.float32)
+
+def getFadeEnvelope(frames, fadeIn=0, fadeOut=0, start=0, end=None):
+    # linear ramps like pydub's fade_in() and fade_out(); lengths are in frames
+    # start and end select part of the clip, e.g. the part that falls in one render block
+    end = frames if end is None else end
+    i = np.arange(start, end, dtype=np.float32)
+    env = np.ones(end - start, dtype=np.float32)
+    if fadeIn > 0:
+        env *= np.minimum(i / fadeIn, 1.0)
+    if fadeOut > 0:
+        env *= np.minimum((frames - i) / fadeOut, 1.0)
+    return env
+
+def getMixCacheFilename(fn, params, cacheDir=MIX_CACHE_DIR):
+    # key on the mix file and everything that changes how it compiles
+    path = os.path.abspath(fn)
+    stat = os.stat(path)
+    key = "%s|%s|%s|%s" % (path, stat.st_mtime, stat.st_size, json.dumps(params, sort_keys=True))
+    if not isinstance(key, bytes):
+        key = key.encode("utf-8")
+    return os.path.join(cacheDir, hashlib.md5(key).hexdigest() + ".npz")
+
+def getMixClip(plan, clipId, frameRate, fadeIn=100, fadeOut=100, channels=2):
+    # decode only this clip's window of its source, with a short fade in/out (ms) to avoid clicking
+    filename = plan["files"][plan["clipSound"][clipId]]
+    clipStart = int(plan["clipStart"][clipId])
+    clipDur = int(plan["clipDur"][clipId])
+    y = readAudioRange(filename, clipStart, clipDur, sr=frameRate, channels=channels)
+    if clipDur > 0:
+        fadeIn = min(fadeIn, clipDur)
+        fadeOut = min(fadeOut, clipDur)
+    return y * getFadeEnvelope(len(y), msToFrames(fadeIn, frameRate), msToFrames(fadeOut, frameRate))[:, np.newaxis]
+
+def getMixDuration(plan, padRight=0):
+    # in ms; clips without a duration (played to the end of their file) count as empty
+    if len(plan["start"]) <= 0:
+        return padRight
+    clipDurs = np.maximum(plan["clipDur"][plan["clip"]], 0)
+    return int(np.max(plan["start"] + clipDurs)) + padRight
+
+def getWavHeader(frameRate, channels=2, sampleWidth=2, frames=-1):
+    # frames < 0 is for streams of unknown length: sizes are set to the maximum
+    dataSize = frames * channels * sampleWidth if frames >= 0 else 0xFFFFFFFF - 36
+    header = b"RIFF" + struct.pack("<I", dataSize + 36) + b"WAVEfmt "
+    header += struct.pack("<IHHIIHH", 16, 1, channels, frameRate, frameRate * channels * sampleWidth, channels * sampleWidth, sampleWidth * 8)
+    return header + b"data" + struct.pack("<I", dataSize)
+
+def makeMixBuffer(frames, channels=2):
+    return np.zeros((frames, channels), dtype=np.float32)
+
+def mixClip(buf, clip, offset, gain=1.0, pan=0.0, fadeIn=0, fadeOut=0):
+    # add clip to buf in place at frame offset; gain is linear, fades are in frames
+    frames = len(clip)
+    i0 = max(offset, 0)
+    i1 = min(offset + frames, len(buf))
+    if i1 <= i0:
+        return buf
+    c0 = i0 - offset
+    c1 = i1 - offset
+    gains = getClipGains(gain, pan)
+    if fadeIn > 0 or fadeOut > 0:
+        env = getFadeEnvelope(frames, fadeIn, fadeOut, c0, c1)
+        buf[i0:i1] += clip[c0:c1] * (env[:, np.newaxis] * gains)
+    else:
+        buf[i0:i1] += clip[c0:c1] * gains
+    return buf
+
+def msToFrames(ms, frameRate):
+    if isinstance(ms, np.ndarray):
+        return (ms * frameRate // 1000).astype(np.int64)
+    return int(ms * frameRate / 1000)
+
+def openEncoder(filename, frameRate, channels=2):
+    # ffmpeg picks the encoder from the output file's extension
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "f32le", "-ar", str(frameRate), "-ac", str(channels), "-i", "pipe:0", filename]
+    return subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+def readMixFile(filename):
+    # sound files, then "---", then rows of: start,soundIndex,clipStart,clipDur,volume,pan,fadeIn,fadeOut[,send]
+    with open(filename) as f:
+        lines = [line.strip() for line in f]
+    splitIndex = lines.index("---") if "---" in lines else len(lines)
+    soundFiles = [line for line in lines[:splitIndex] if len(line) > 0]
+    rows = [line.split(",") for line in lines[splitIndex+1:] if len(line) > 0]
+    # the effect send level is optional and defaults to a full send
+    rows = [row if len(row) > 8 else row + ["1.0"] for row in rows]
+    values = list(zip(*rows)) if len(rows) > 0 else [() for i in range(9)]
+    types = [np.int64, np.int64, np.int64, np.int64, np.float64, np.float64, np.int64, np.int64, np.float64]
+    columns = [np.array(values[i], dtype=str).astype(t) for i, t in enumerate(types)]
+    return (soundFiles, columns)
+
+def renderMixBlocks(plan, getClips, frameRate, blockFrames=2**16, padRight=0, channels=2, effect=None, startFrame=0, endFrame=-1, preroll=0, showProgress=True):
+    # yields the mix in fixed-size blocks; only events overlapping a block are mixed into it,
+    # and a clip is kept in memory from its first event until its last event has finished
+    # getClips(clipIds) returns a list of frames x channels arrays
+    # effect(block, state) -> (wet, state) processes the send bus once per block, e.g. a reverb
+    # startFrame and endFrame limit output to a window; rendering starts preroll frames earlier
+    # so effect tails from before the window ring into it
+    sends = plan["send"] if "send" in plan else np.ones(len(plan["start"]), dtype=np.float32)
+    effectState = None
+    starts = msToFrames(plan["start"], frameRate)
+    fadeIns = msToFrames(plan["fadeIn"], frameRate)
+    fadeOuts = msToFrames(plan["fadeOut"], frameRate)
+    clipIds = plan["clip"]
+    count = len(starts)
+    refCounts = np.bincount(clipIds, minlength=len(plan["clipSound"]))
+    clips = {}
+    active = []
+    nextEvent = 0
+    end = 0
+    blockStart = max(startFrame - preroll, 0)
+    while True:
+        blockEnd = blockStart + blockFrames
+        # events are sorted by start, so activate the ones that start before this block ends
+        newEvents = []
+        while nextEvent < count and starts[nextEvent] < blockEnd:
+            newEvents.append(nextEvent)
+            nextEvent += 1
+        # load this block's new clips in one batch so the loader can read them in parallel
+        newClipIds = sorted(set([clipIds[i] for i in newEvents if clipIds[i] not in clips]))
+        if len(newClipIds) > 0:
+            clips.update(zip(newClipIds, getClips(newClipIds)))
+        for i in newEvents:
+            end = max(end, starts[i] + len(clips[clipIds[i]]))
+            active.append(i)
+
+        # total length is only known once every event has been seen
+        frames = blockFrames
+        if nextEvent >= count:
+            frames = min(frames, end + padRight - blockStart)
+        if endFrame > 0:
+            frames = min(frames, endFrame - blockStart)
+        if frames <= 0:
+            break
+
+        buf = makeMixBuffer(frames, channels)
+        bus = makeMixBuffer(frames, channels) if effect is not None else None
+        stillActive = []
+        for i in active:
+            clipId = clipIds[i]
+            clip = clips[clipId]
+            mixClip(buf, clip, starts[i] - blockStart, gain=plan["gain"][i], pan=plan["pan"][i], fadeIn=fadeIns[i], fadeOut=fadeOuts[i])
+            if bus is not None and sends[i] > 0:
+                mixClip(bus, clip, starts[i] - blockStart, gain=plan["gain"][i]*sends[i], pan=plan["pan"][i], fadeIn=fadeIns[i], fadeOut=fadeOuts[i])
+            if starts[i] + len(clip) > blockEnd:
+                stillActive.append(i)
+                continue
+            refCounts[clipId] -= 1
+            if refCounts[clipId] <= 0:
+                del clips[clipId]
+        active = stillActive
+
+        # the bus is processed over the summed signal, carrying effect state across blocks
+        if bus is not None:
+            wet, effectState = effect(bus, effectState)
+            buf += wet
+
+        if showProgress and count > 0:
+            sys.stdout.write('\r')
+            sys.stdout.write("%s%%" % round(1.0*nextEvent/count*100,1))
+            sys.stdout.flush()
+
+        # nothing is output before the window starts
+        if blockEnd > startFrame:
+            yield buf[max(startFrame - blockStart, 0):]
+        blockStart = blockEnd
+
+def selectMixEvents(plan, indices):
+    # subset of events, e.g. an excerpt; the clip table is kept as is
+    selected = dict(plan)
+    for key in MIX_EVENT_KEYS:
+        selected[key] = plan[key][indices]
+    return selected
+
+def selectMixWindow(plan, start=-1, end=-1, preroll=0):
+    # events that start before the window ends and may still be ringing (within preroll ms) when it starts
+    window = np.ones(len(plan["start"]), dtype=bool)
+    if start > 0:
+        # clips without a duration play to the end of their file, so they can't be ruled out
+        clipDurs = plan["clipDur"][plan["clip"]]
+        clipEnds = plan["start"] + np.where(clipDurs > 0, clipDurs, np.inf)
+        window &= clipEnds > (start - preroll)
+    if end > 0:
+        window &= plan["start"] < end
+    return selectMixEvents(plan, np.flatnonzero(window))
+
+def writeEncoderQueue(encoder, queue):
+    # runs in its own thread so each encoder works alongside rendering and the other encoders
+    failed = False
+    while True:
+        data = queue.get()
+        if data is None:
+            break
+        # keep draining after a failure so the renderer never blocks on a dead encoder
+        if failed:
+            continue
+        try:
+            encoder.stdin.write(data)
+        except IOError:
+            failed = True
+    try:
+        encoder.stdin.close()
+    except IOError:
+        pass
+    encoder.wait()
+
+def writeMixBlocks(blocks, filenames, frameRate, channels=2, queueSize=16):
+    # pipe blocks straight to one encoder per output file (e.g. mp3, ogg and a wav master at once)
+    # so the full mix is never held in memory or written to a temporary file
+    if not isinstance(filenames, list):
+        filenames = [filenames]
+    encoders = [openEncoder(fn, frameRate, channels) for fn in filenames]
+    queues = [Queue.Queue(maxsize=queueSize) for fn in filenames]
+    threads = [threading.Thread(target=writeEncoderQueue, args=(encoder, queue)) for encoder, queue in zip(encoders, queues)]
+    for thread in threads:
+        thread.start()
+    frames = 0
+    try:
+        for block in blocks:
+            data = np.clip(block, -1.0, 1.0).astype("<f4").tobytes()
+            for queue in queues:
+                queue.put(data)
+            frames += len(block)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+    failed = []
+    for fn, encoder in zip(filenames, encoders):
+        if encoder.returncode != 0:
+            print("ffmpeg exited with code %s while writing %s" % (encoder.returncode, fn))
+            failed.append(fn)
+            # don't leave a partial file that a later run would take as done
+            if os.path.isfile(fn):
+                os.remove(fn)
+    if len(failed) > 0:
+        raise IOError("Failed to write %s" % ", ".join(failed))
+    return frames
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# Phrases are stored ragged: one flat table of notes plus offsets, where the notes of
+# phrase i are notes[offsets[i]:offsets[i+1]]
+
+from io_utils import isColumnStore, readColumns, readCsvColumns, writeColumns
+import numpy as np
+import os
+
+NOTE_COLUMNS = ["start", "dur", "power", "hz", "note", "octave"]
+NOTE_TYPES = [np.int64, np.int64, np.float64, np.float64, str, np.int64]
+
+def getPhrase(data, i):
+    # views into the note table, no copies
+    i0 = data["offsets"][i]
+    i1 = data["offsets"][i+1]
+    phrase = {"notes": dict([(key, values[i0:i1]) for key, values in data["notes"].items()])}
+    for key in data:
+        if key not in ("notes", "offsets"):
+            phrase[key] = data[key][i]
+    return phrase
+
+def getPhraseCount(data):
+    return len(data["offsets"]) - 1
+
+def getPhraseMeans(offsets, values):
+    counts = np.diff(offsets)
+    sums = np.zeros(len(counts))
+    # reduceat only works on non-empty segments; each one then runs up to the next non-empty start
+    nonEmpty = counts > 0
+    if np.any(nonEmpty):
+        sums[nonEmpty] = np.add.reduceat(values, offsets[:-1][nonEmpty])
+    return sums / np.maximum(counts, 1)
+
+def getPhrasePairs(offsets):
+    # indices of each note and the next note within the same phrase, with their own offsets
+    count = offsets[-1]
+    isLast = np.zeros(count, dtype=bool)
+    ends = offsets[1:][offsets[1:] > offsets[:-1]]
+    isLast[ends - 1] = True
+    prevIndices = np.flatnonzero(~isLast)
+    pairCounts = np.maximum(np.diff(offsets) - 1, 0)
+    pairOffsets = np.concatenate(([0], np.cumsum(pairCounts)))
+    return (prevIndices, prevIndices + 1, pairOffsets)
+
+def getPhraseStds(offsets, values):
+    means = getPhraseMeans(offsets, values)
+    deviations = values - np.repeat(means, np.diff(offsets))
+    return np.sqrt(getPhraseMeans(offsets, deviations**2))
+
+def iterPhrases(data, start=0, end=None):
+    end = getPhraseCount(data) if end is None else min(end, getPhraseCount(data))
+    for i in range(start, end):
+        yield getPhrase(data, i)
+
+def parsePhraseStrings(strings):
+    # e.g. "start:dur:power:hz:note:octave,start:dur:power:hz:note:octave"
+    counts = np.array([s.count(",") + 1 for s in strings], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    rows = [note.split(":") for note in ",".join(strings).split(",")] if len(strings) > 0 else []
+    values = list(zip(*rows)) if len(rows) > 0 else [() for key in NOTE_COLUMNS]
+    notes = {}
+    for i, key in enumerate(NOTE_COLUMNS):
+        notes[key] = np.array(values[i], dtype=str).astype(NOTE_TYPES[i])
+    return (notes, offsets)
+
+def phrasesToColumns(phrases, headings=["parent", "start", "dur"]):
+    # phrases are dicts with a "phrase" list of note dicts, as returned by getPhrases()
+    counts = [len(p["phrase"]) for p in phrases]
+    data = dict([(key, np.array([p[key] for p in phrases])) for key in headings])
+    data["notes"] = dict([(key, np.array([n[key] for p in phrases for n in p["phrase"]])) for key in NOTE_COLUMNS])
+    data["offsets"] = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return data
+
+def readPhrases(filename, mmap=True):
+    # ragged phrase store
+    if isColumnStore(filename):
+        data = readColumns(filename, mmap=mmap)
+        data["notes"] = readColumns(os.path.join(filename, "notes"), mmap=mmap)
+        data["offsets"] = np.load(os.path.join(filename, "offsets.npy"), mmap_mode=("r" if mmap else None))
+        return data
+
+    # csv with phrase strings
+    data = readCsvColumns(filename, schema="phrases")
+    data["notes"], data["offsets"] = parsePhraseStrings(data.pop("phrase"))
+    return data
+
+def selectPhrases(data, indices):
+    # copy a subset of phrases into a new ragged set
+    indices = np.asarray(indices, dtype=np.int64)
+    offsets = data["offsets"]
+    counts = offsets[indices+1] - offsets[indices]
+    newOffsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    noteIndices = np.repeat(offsets[indices] - newOffsets[:-1], counts) + np.arange(newOffsets[-1])
+    selected = {"offsets": newOffsets, "notes": dict([(key, values[noteIndices]) for key, values in data["notes"].items()])}
+    for key in data:
+        if key not in ("notes", "offsets"):
+            selected[key] = data[key][indices]
+    return selected
+
+def stringifyPhrase(notes):
+    rows = [[n[key] for key in NOTE_COLUMNS] for n in notes]
+    return ",".join([":".join([str(col) for col in row]) for row in rows])
+
+def writePhrases(dirname, phrases, headings=["parent", "start", "dur"]):
+    # phrases can be a list of phrase dicts or ragged columns as returned by readPhrases()
+    data = phrases if isinstance(phrases, dict) else phrasesToColumns(phrases, headings)
+    writeColumns(dirname, data, headings)
+    writeColumns(os.path.join(dirname, "notes"), data["notes"], NOTE_COLUMNS)
+    np.save(os.path.join(dirname, "offsets.npy"), np.asarray(data["offsets"], dtype=np.int64))
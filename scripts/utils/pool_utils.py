@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing
+from multiprocessing import Pool
+import signal
+import sys
+
+class TaskTimeout(Exception):
+    pass
+
+def _initWorker():
+    # let the parent handle ctrl-c and terminate the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _onTaskTimeout(signum, frame):
+    raise TaskTimeout()
+
+def _runTask(task):
+    # returns (item, result, error); error is None unless the task failed, then result is the default
+    fn, item, timeout, default = task
+    # the timer runs in the worker, so it measures this task only (not time spent queued)
+    if timeout > 0:
+        signal.signal(signal.SIGALRM, _onTaskTimeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        try:
+            return (item, fn(item), None)
+        finally:
+            if timeout > 0:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except TaskTimeout:
+        error = "timed out after %ss" % timeout
+    except Exception as e:
+        error = "%s: %s" % (type(e).__name__, e)
+    print("\nError processing %s: %s" % (item, error))
+    return (item, default, error)
+
+def printFailures(errors, total):
+    if len(errors) <= 0:
+        return
+    print("\n%s of %s failed:" % (len(errors), total))
+    for item, error in errors:
+        print("  %s: %s" % (item, error))
+
+def printProgress(progress, total):
+    sys.stdout.write('\r')
+    sys.stdout.write("%s%%" % round(1.0*progress/total*100,1))
+    sys.stdout.flush()
+
+def runPool(fn, items, workers=-1, chunksize=1, ordered=True, timeout=-1, default=None, showProgress=True, returnErrors=False):
+    # fn must be a module-level function so it can be sent to worker processes
+    # a task that fails or times out gives the default; with returnErrors, (results, [(item, error)]) is returned
+    # so callers can tell a failed item from one with an empty result
+    if workers <= 0:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, max(len(items), 1))
+    timeout = timeout if timeout is not None else -1
+    tasks = [(fn, item, timeout, default) for item in items]
+    total = len(tasks)
+    results = []
+    errors = []
+
+    # run in this process, e.g. for plotting or debugging
+    if workers <= 1:
+        for task in tasks:
+            item, result, error = _runTask(task)
+            results.append(result)
+            if error is not None:
+                errors.append((item, error))
+            if showProgress:
+                printProgress(len(results), total)
+        printFailures(errors, total)
+        return (results, errors) if returnErrors else results
+
+    pool = Pool(processes=workers, initializer=_initWorker)
+    try:
+        if ordered:
+            iterator = pool.imap(_runTask, tasks, chunksize)
+        else:
+            iterator = pool.imap_unordered(_runTask, tasks, chunksize)
+        # progress is only counted here in the parent as results arrive
+        for item, result, error in iterator:
+            results.append(result)
+            if error is not None:
+                errors.append((item, error))
+            if showProgress:
+                printProgress(len(results), total)
+    except KeyboardInterrupt:
+        pool.terminate()
+        pool.join()
+        raise
+    pool.close()
+    pool.join()
+
+    printFailures(errors, total)
+    return (results, errors) if returnErrors else results
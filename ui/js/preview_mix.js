@@ -0,0 +1,117 @@
+'use strict';
+
+// Plays a mix streamed by scripts/preview_mix.py; seeking restarts the stream at the new position
+var AppPreviewMix = (function() {
+
+  function AppPreviewMix(config) {
+    var defaults = {
+      previewUrl: "http://localhost:2223"
+    };
+    this.opt = _.extend({}, defaults, config);
+    this.init();
+  }
+
+  function formatTime(ms) {
+    var seconds = Math.floor(ms / 1000);
+    var minutes = Math.floor(seconds / 60);
+    seconds = seconds % 60;
+    return minutes + ":" + (seconds < 10 ? "0" : "") + seconds;
+  }
+
+  AppPreviewMix.prototype.init = function(){
+    this.$el = $("#app");
+    this.$info = $("#mix-info");
+    this.$toggle = $("#toggle-play");
+    this.$time = $("#time");
+    this.$duration = $("#duration");
+    this.$seek = $("#seek");
+    this.audio = $("#audio")[0];
+
+    // the stream always starts at streamStart, so the audio element's time is relative to it
+    this.streamStart = 0;
+    this.playing = false;
+    this.seeking = false;
+
+    this.loadInfo();
+    this.loadListeners();
+  };
+
+  AppPreviewMix.prototype.getTime = function(){
+    return this.streamStart + Math.round(this.audio.currentTime * 1000);
+  };
+
+  AppPreviewMix.prototype.loadInfo = function(){
+    var _this = this;
+    $.getJSON(this.opt.previewUrl + "/info", function(info) {
+      _this.duration = info.duration;
+      _this.$info.text(info.mix + ": " + info.events + " events");
+      _this.$duration.text(formatTime(info.duration));
+      _this.$seek.attr("max", info.duration);
+    }).fail(function() {
+      _this.$info.text("Could not reach the preview server at " + _this.opt.previewUrl);
+    });
+  };
+
+  AppPreviewMix.prototype.loadListeners = function(){
+    var _this = this;
+
+    this.$toggle.on("click", function(e){
+      e.preventDefault();
+      _this.togglePlay();
+    });
+
+    this.$seek.on("input", function(e){
+      _this.seeking = true;
+      _this.$time.text(formatTime(parseInt($(this).val())));
+    });
+
+    this.$seek.on("change", function(e){
+      _this.seeking = false;
+      _this.play(parseInt($(this).val()));
+    });
+
+    $(this.audio).on("timeupdate", function(e){
+      if (_this.seeking) return;
+      var time = _this.getTime();
+      _this.$time.text(formatTime(time));
+      _this.$seek.val(time);
+    });
+
+    $(this.audio).on("ended", function(e){
+      _this.pause();
+    });
+  };
+
+  AppPreviewMix.prototype.pause = function(){
+    this.streamStart = this.getTime();
+    this.audio.pause();
+    // drop the stream so the server stops rendering
+    this.audio.removeAttribute("src");
+    this.audio.load();
+    this.playing = false;
+    this.$toggle.text("Play");
+  };
+
+  AppPreviewMix.prototype.play = function(start){
+    if (start === undefined) start = this.streamStart;
+    if (this.duration && start >= this.duration) start = 0;
+    this.streamStart = start;
+    // the timestamp keeps the browser from reusing a cached stream, e.g. after the mix file changed
+    this.audio.src = this.opt.previewUrl + "/mix.wav?start=" + start + "&t=" + Date.now();
+    this.audio.play();
+    this.playing = true;
+    this.$toggle.text("Pause");
+  };
+
+  AppPreviewMix.prototype.togglePlay = function(){
+    if (this.playing) this.pause();
+    else this.play();
+  };
+
+  return AppPreviewMix;
+
+})();
+
+$(function() {
+  var app = new AppPreviewMix({});
+});